@@ -13,13 +13,13 @@ import platform
 import random
 import sys
 
-import aiosqlite
 import discord
 from discord.ext import commands, tasks
 from discord.ext.commands import Context
 from dotenv import load_dotenv
 
-from database import DatabaseManager
+import exceptions
+from database import DatabaseManager, connect, migrate
 
 if not os.path.isfile(f"{os.path.realpath(os.path.dirname(__file__))}/config.json"):
     sys.exit("'config.json' not found! Please add it and try again.")
@@ -106,20 +106,7 @@ class LoggingFormatter(logging.Formatter):
 
 logger = logging.getLogger("discord_bot")
 logger.setLevel(logging.INFO)
-
-# Console handler
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(LoggingFormatter())
-# File handler
-file_handler = logging.FileHandler(filename="discord.log", encoding="utf-8", mode="w")
-file_handler_formatter = logging.Formatter(
-    "[{asctime}] [{levelname:<8}] {name}: {message}", "%Y-%m-%d %H:%M:%S", style="{"
-)
-file_handler.setFormatter(file_handler_formatter)
-
-# Add the handlers
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
+# The handlers are added when the bot is started, see the bottom of this file
 
 
 class DiscordBot(commands.Bot):
@@ -140,16 +127,31 @@ class DiscordBot(commands.Bot):
         self.logger = logger
         self.config = config
         self.database = None
+        self.add_check(self.check_blacklist)
+
+    async def check_blacklist(self, context: Context) -> bool:
+        """
+        This global check runs before every command, blacklisted users are looked up in memory, not in the database.
+
+        :param context: The context of the command that is about to be executed.
+        """
+        if self.database is not None and context.author.id in self.database.blacklist:
+            raise exceptions.UserBlacklisted
+        return True
 
     async def init_db(self) -> None:
-        async with aiosqlite.connect(
+        db = await connect(
             f"{os.path.realpath(os.path.dirname(__file__))}/database/database.db"
-        ) as db:
+        )
+        try:
+            await migrate(db)
             with open(
                 f"{os.path.realpath(os.path.dirname(__file__))}/database/schema.sql"
             ) as file:
                 await db.executescript(file.read())
             await db.commit()
+        finally:
+            await db.close()
 
     async def load_cogs(self) -> None:
         """
@@ -194,13 +196,23 @@ class DiscordBot(commands.Bot):
         )
         self.logger.info("-------------------")
         await self.init_db()
+        # The database has to be ready before the cogs are loaded, some of them read from it when loading
+        # One connection writes, reads are spread over a few more so they never wait behind writes
+        self.database = await DatabaseManager.open(
+            f"{os.path.realpath(os.path.dirname(__file__))}/database/database.db"
+        )
         await self.load_cogs()
         self.status_task.start()
-        self.database = DatabaseManager(
-            connection=await aiosqlite.connect(
-                f"{os.path.realpath(os.path.dirname(__file__))}/database/database.db"
-            )
-        )
+
+    async def close(self) -> None:
+        """
+        This will be executed when the bot shuts down, the cogs are unloaded first and the queued database writes are committed last.
+        """
+        await super().close()
+        if self.database is not None:
+            self.logger.info(f"Warning cache: {self.database.warning_cache.stats()}")
+            await self.database.close()
+            self.database = None
 
     async def on_message(self, message: discord.Message) -> None:
         """
@@ -246,6 +258,22 @@ class DiscordBot(commands.Bot):
                 color=0xE02B2B,
             )
             await context.send(embed=embed)
+        elif isinstance(error, exceptions.UserBlacklisted):
+            """
+            The code here will only execute if the error is an instance of 'UserBlacklisted', which is raised by the global blacklist check.
+            """
+            embed = discord.Embed(
+                description="You are blacklisted from using the bot!", color=0xE02B2B
+            )
+            await context.send(embed=embed)
+            if context.guild:
+                self.logger.warning(
+                    f"{context.author} (ID: {context.author.id}) tried to execute a command in the guild {context.guild.name} (ID: {context.guild.id}), but the user is blacklisted from using the bot."
+                )
+            else:
+                self.logger.warning(
+                    f"{context.author} (ID: {context.author.id}) tried to execute a command in the bot's DMs, but the user is blacklisted from using the bot."
+                )
         elif isinstance(error, commands.NotOwner):
             embed = discord.Embed(
                 description="You are not the owner of the bot!", color=0xE02B2B
@@ -287,7 +315,23 @@ class DiscordBot(commands.Bot):
             raise error
 
 
-load_dotenv()
+# Worker processes, e.g. of the recommender training, import this file again without starting a second bot
+if __name__ == "__main__":
+    # Console handler
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(LoggingFormatter())
+    # File handler
+    file_handler = logging.FileHandler(filename="discord.log", encoding="utf-8", mode="w")
+    file_handler_formatter = logging.Formatter(
+        "[{asctime}] [{levelname:<8}] {name}: {message}", "%Y-%m-%d %H:%M:%S", style="{"
+    )
+    file_handler.setFormatter(file_handler_formatter)
+
+    # Add the handlers
+    logger.addHandler(console_handler)
+    logger.addHandler(file_handler)
+
+    load_dotenv()
 
-bot = DiscordBot()
-bot.run(os.getenv("TOKEN"))
+    bot = DiscordBot()
+    bot.run(os.getenv("TOKEN"))
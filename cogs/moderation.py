@@ -199,9 +199,10 @@ class Moderation(commands.Cog, name="moderation"):
         member = context.guild.get_member(user.id) or await context.guild.fetch_member(
             user.id
         )
-        total = await self.bot.database.add_warn(
+        await self.bot.database.add_warn(
             user.id, context.guild.id, context.author.id, reason
         )
+        total = await self.bot.database.get_warning_count(user.id, context.guild.id)
         embed = discord.Embed(
             description=f"**{member}** was warned by **{context.author}**!\nTotal warns for this user: {total}",
             color=0xBEBEFE,
@@ -1,12 +1,26 @@
-import pandas as pd
-from surprise import Dataset, Reader, SVD
+import functools
 import discord
 from discord.ext import commands
-from fuzzywuzzy import process
 import os
-from openai import OpenAI
+import sqlite3
+from openai import APIError
 import asyncio
 
+from recommender import (
+    AssistantClient,
+    MappedRatingStore,
+    RetrainScheduler,
+    TitleIndex,
+    TrainingWorker,
+    TTLCache,
+    UserRegistry,
+    fit_model,
+    get_dataset,
+    get_engine,
+    load_snapshot,
+    normalize_title,
+    ratings_fingerprint,
+)
 
 OPEN_AI_API_KEY = "YOUR OPENAI API KEY HERE!"
 OPEN_AI_ASSISTANTS_ID = "YOUR OPENAI ASSISTANTS ID HERE!"
@@ -14,98 +28,234 @@ OPEN_AI_ASSISTANTS_ID = "YOUR OPENAI ASSISTANTS ID HERE!"
 
 
 
-client = OpenAI(
-    api_key=OPEN_AI_API_KEY, 
-)
 # Main recommend COG class
 class Recommend(commands.Cog, name="recommend"):
     def __init__(self, bot) -> None:
         self.bot = bot
 
-        # Initialize data
-        self.data_file = 'ml-100k/u.data'
-        self.user_file = 'ml-100k/u.user'
-        self.item_file = 'ml-100k/u.item'
+        settings = bot.config.get("recommender", {})
+
+        # Initialize data, any of the supported MovieLens releases can be used
+        self.dataset = get_dataset(settings.get("dataset", "ml-100k"), settings.get("dataset_path"))
+
+        # Load data, the registered users are read from the database when the cog is loaded
+        self.users = UserRegistry()
+        # Every rating, memory-mapped from a binary store so retraining never has to parse text or go back to the database
+        self.ratings_dir = settings.get("ratings_dir", "ratings")
+        self.ratings = None
+        self.reindex_task = None
+        self.movie_titles, self.movie_names, self.title_index = self.load_movie_titles()
+
+        self.model_dir = settings.get("model_dir", "models")
+
+        # Which recommender engine is fitted and how: svd, als or item_knn, a typo in either fails here rather than at the first retrain
+        engine = get_engine(settings.get("engine", "svd"))
+        engine.check_options(settings.get("engine_options", {}))
+        self.engine = engine.name
+
+        # The model is fitted by the training worker, /recommend keeps serving the previous one meanwhile
+        self.algo = None
+        self.training_worker = TrainingWorker(
+            functools.partial(
+                fit_model,
+                snapshot_dir=self.model_dir,
+                n_neighbors=settings.get("similar_neighbors", 20),
+                rating_scale=self.dataset.rating_scale,
+                engine=self.engine,
+                engine_options=settings.get("engine_options", {}),
+            ),
+            self.swap_model,
+            load_fn=self.load_data,
+        )
 
-        # Load data
-        self.user_id_mapping, self.username_mapping = self.load_users()
-        self.movie_titles = self.load_movie_titles()
-        self.data = self.load_data()
-        
-        # Initialize and train model
-        self.algo = SVD()
-        self.retrain_model()
+        # New ratings are buffered and folded into one retrain per window or batch
+        self.retrain_scheduler = RetrainScheduler(
+            self.training_worker,
+            interval=settings.get("retrain_interval", 60),
+            batch_size=settings.get("retrain_batch_size", 50),
+        )
+        # Fold each new rating into the served model right away, the batched retrain bounds the drift
+        self.incremental_updates = settings.get("incremental_updates", True)
+
+        # A single async client with a pooled HTTP session is shared by every /recommend
+        self.assistant = AssistantClient(
+            api_key=OPEN_AI_API_KEY,
+            assistant_id=OPEN_AI_ASSISTANTS_ID,
+            **bot.config.get("openai", {}),
+        )
 
-    # Init function to load all registered users with the bot
-    def load_users(self):
-        if not os.path.exists(self.user_file):
-            return {}, {}
+        # Titles the assistant extracted, by normalized query, kept across restarts
+        self.intent_cache = TTLCache(
+            max_size=settings.get("intent_cache_size", 4096),
+            ttl=settings.get("intent_cache_ttl", 86400),
+        )
+        self.intent_cache_file = settings.get("intent_cache_file", "intent_cache.json")
+        self.intent_cache.load(self.intent_cache_file)
+        # Queries that already match a title at least this well never reach the assistant
+        self.precheck_score = settings.get("precheck_score", 95)
+
+    # Serve the last saved model straight away and only retrain, in the background, if the ratings changed since
+    async def cog_load(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.ratings = await self.load_ratings()
+        description = await loop.run_in_executor(None, self.ratings.describe)
+        self.bot.logger.info(f"Recommender data ({self.dataset.name}): {description}")
+        self.users = await self.load_users()
+
+        snapshot = await loop.run_in_executor(None, load_snapshot, self.model_dir)
+        if snapshot is not None:
+            algo, fingerprint = snapshot
+            algo.history = self.ratings.user_ratings
+            self.algo = algo
+            fresh = fingerprint == await loop.run_in_executor(None, ratings_fingerprint, *self.ratings.columns())
+            if fresh and algo.name == self.engine:
+                self.bot.logger.info(f"Loaded the {algo.name} recommender model from its snapshot")
+                return
+        self.retrain_model()
 
-        column_names = ['user_id', 'age', 'gender', 'occupation', 'discord_username', 'discord_user_id']
-        user_data = pd.read_csv(self.user_file, delimiter='|', names=column_names)
-        id_mapping = {str(row['discord_user_id']): str(row['user_id']) for _, row in user_data.iterrows() if pd.notna(row['discord_user_id'])}
-        name_mapping = {row['discord_username']: str(row['user_id']) for _, row in user_data.iterrows() if pd.notna(row['discord_username'])}
-        return id_mapping, name_mapping
+    async def cog_unload(self) -> None:
+        self.retrain_scheduler.cancel()
+        self.training_worker.shutdown()
+        await self.assistant.close()
+        self.intent_cache.save(self.intent_cache_file)
+        if self.reindex_task is not None:
+            self.reindex_task.cancel()
+        if self.ratings is not None:
+            self.ratings.flush()
+
+    # Init function to load all registered users with the bot, new ids start above every user that has ratings
+    async def load_users(self):
+        users = await self.bot.database.get_recommender_users()
+        rating_users, _, _ = self.ratings.columns()
+        max_user_id = max(await self.bot.database.get_max_recommender_user_id(), int(rating_users.max(initial=0)))
+        return UserRegistry.from_rows(users, max_user_id)
+
+    # Maps the rating store, it is only built here the first time, from the database or else from the MovieLens files
+    async def load_ratings(self):
+        loop = asyncio.get_running_loop()
+        if MappedRatingStore.exists(self.ratings_dir):
+            ratings = await loop.run_in_executor(None, MappedRatingStore.open, self.ratings_dir)
+            # The store only saves its size when flushed, the database has every rating added since,
+            # by rowid as the MovieLens ratings of a converted store were never in the database
+            last_rowid = await self.bot.database.get_last_rating_rowid()
+            if ratings.last_rowid is not None:
+                async for rows in self.bot.database.iter_ratings(after_rowid=ratings.last_rowid):
+                    ratings.extend_rows(rows)
+            ratings.last_rowid = max(ratings.last_rowid or 0, last_rowid)
+            return ratings
+
+        # Built next to its final place and renamed once complete, an interrupted build is simply started over
+        build_dir = f"{self.ratings_dir}.build"
+        ratings = await loop.run_in_executor(None, MappedRatingStore.create, build_dir)
+        async for rows in self.bot.database.iter_ratings():
+            ratings.extend_rows(rows)
+        if not len(ratings) and self.dataset.exists:
+            await self.import_movielens(ratings)
+        ratings.last_rowid = await self.bot.database.get_last_rating_rowid()
+        await loop.run_in_executor(None, ratings.reindex)
+        os.replace(build_dir, self.ratings_dir)
+        return await loop.run_in_executor(None, MappedRatingStore.open, self.ratings_dir)
+
+    # Moves the MovieLens users and ratings into the database and the rating store, run once when both are still empty
+    async def import_movielens(self, ratings):
+        loop = asyncio.get_running_loop()
+        users = await loop.run_in_executor(None, self.dataset.read_users)
+        await self.bot.database.import_recommender_users(users)
+
+        # The ratings file is parsed and inserted one chunk at a time
+        imported = 0
+        chunks = self.dataset.iter_ratings()
+        while (chunk := await loop.run_in_executor(None, next, chunks, None)) is not None:
+            await self.bot.database.import_ratings(list(zip(*(column.tolist() for column in chunk))))
+            ratings.extend(*chunk)
+            imported += len(chunk[0])
+        self.bot.logger.info(f"Imported {len(users)} users and {imported} ratings from {self.dataset.name}")
+
+    # Sorts the ratings added through the bot into the indexed part of the store, off the event loop, looking a user up scans the rest
+    async def reindex_ratings(self):
+        loop = asyncio.get_running_loop()
+        try:
+            segment, indexed = await loop.run_in_executor(None, self.ratings.write_index)
+        except Exception:
+            self.bot.logger.exception("Reindexing the rating store failed")
+            return
+        # Back on the event loop, so no rating is appended while the store switches segments
+        self.ratings.use_index(segment, indexed)
 
+    # Hands the mapped rating columns to the training worker, no copy and no database round trip
+    async def load_data(self):
+        return self.ratings.columns()
 
-    # Loads all movie titles from the data file
+    # Loads all movie titles from the data file, both title to id and id to title, and builds the fuzzy search index over them
     def load_movie_titles(self):
-        item_data = pd.read_csv(self.item_file, delimiter='|', encoding='ISO-8859-1', 
-                                usecols=[0, 1], names=['movie_id', 'title'])
-        return dict(zip(item_data['title'], item_data['movie_id']))
+        movie_names = self.dataset.load_movies()
+        movie_titles = {title: movie_id for movie_id, title in movie_names.items()}
+        return movie_titles, movie_names, TitleIndex(movie_names.items())
 
-    # Loads all of the total data from the dataset
-    def load_data(self):
-        reader = Reader(line_format='user item rating timestamp', sep='\t', rating_scale=(1, 5))
-        return Dataset.load_from_file(self.data_file, reader=reader)
-
-    # Used to retrain the model when new data is added by users.
+    # Retrains the model right away, the data is reloaded and fitted off the event loop
     def retrain_model(self):
-        trainset = self.data.build_full_trainset()
-        self.algo.fit(trainset)
+        return self.retrain_scheduler.trigger()
+
+    # Called by the training worker with a freshly fitted model, a single assignment so requests never see a half trained model
+    def swap_model(self, algo):
+        algo.history = self.ratings.user_ratings
+        # Ratings that came in while it was training are not part of the new model yet
+        if self.incremental_updates and self.retrain_scheduler.pending:
+            algo.partial_fit(self.retrain_scheduler.pending)
+        self.algo = algo
+        self.bot.logger.info(f"Recommender model retrained ({algo.name})")
 
     # Function to add a user to the data
     async def add_user(self, discord_user):
         discord_user_id = str(discord_user.id)
         discord_username = discord_user.name
 
-        if discord_username in self.username_mapping:
-            return False, f"Discord username '{discord_username}' is already registered with ID {self.username_mapping[discord_username]}."
+        existing_user_id = await self.resolve_user(discord_user)
+        if existing_user_id is not None:
+            return False, f"Discord username '{discord_username}' is already registered with ID {existing_user_id}."
 
-        new_user_id = max([int(uid) for uid in self.user_id_mapping.values() if uid.isdigit()], default=0) + 1
-        self.user_id_mapping[discord_user_id] = str(new_user_id)
-        self.username_mapping[discord_username] = str(new_user_id)
+        new_user_id = self.users.allocate_id()
+        try:
+            await self.bot.database.add_recommender_user(new_user_id, discord_user_id, discord_username)
+        except sqlite3.IntegrityError:
+            return False, f"Discord username '{discord_username}' is already registered."
 
-        # Format the new user data to match the existing structure of the u.user file
-        new_user_data = f"\n{new_user_id}|M|other|00000|{discord_username}|{discord_user_id}\n"
-
-        with open(self.user_file, 'a') as f:
-            f.write(new_user_data)
+        self.users.add(new_user_id, discord_user_id, discord_username)
 
         return True, f"Discord username '{discord_username}' added with ID {new_user_id}."
 
+    # Finds the registered user behind a Discord user by their Discord ID, a rename only updates the stored username
+    async def resolve_user(self, discord_user):
+        user_id, renamed = self.users.resolve(str(discord_user.id), discord_user.name)
+        if renamed:
+            await self.bot.database.update_recommender_username(user_id, discord_user.name)
+        return user_id
+
     # Function to add a rating to a given movie name, requires a user to already be added to the database
     async def add_rating(self, discord_user, partial_movie_title: str, rating: float):
         discord_username = discord_user.name
 
-        if discord_username not in self.username_mapping:
+        user_id = await self.resolve_user(discord_user)
+        if user_id is None:
             return False, "Discord user not found. Please register first."
 
-        user_id = self.username_mapping[discord_username]
-
         # Find the closest match for the movie title
-        closest_match = process.extractOne(partial_movie_title, self.movie_titles.keys(), score_cutoff=70)
+        closest_match = self.title_index.match(partial_movie_title)
         if not closest_match:
             return False, "No close match found for the movie title. Please try again."
 
-        movie_title, movie_id = closest_match[0], self.movie_titles[closest_match[0]]
+        movie_title, movie_id = closest_match[0], closest_match[1]
 
-        with open(self.data_file, 'a') as f:
-            f.write(f"{user_id}\t{movie_id}\t{rating}\t0\n")
+        rowid = await self.bot.database.add_rating(user_id, int(movie_id), rating)
+        self.ratings.append(user_id, int(movie_id), rating)
+        self.ratings.last_rowid = max(self.ratings.last_rowid, rowid)
+        if self.ratings.needs_reindex and (self.reindex_task is None or self.reindex_task.done()):
+            self.reindex_task = asyncio.create_task(self.reindex_ratings())
 
-        # Update the data and retrain the model
-        self.data = self.load_data()
-        self.retrain_model()
+        # Update the served model now and queue the rating for the next batched retrain
+        if self.incremental_updates and self.algo is not None:
+            self.algo.partial_fit([(user_id, movie_id, rating)])
+        self.retrain_scheduler.add((user_id, movie_id, rating))
 
         return True, f"Rating added for Discord user '{discord_username}' on movie '{movie_title}'."
 
@@ -127,6 +277,23 @@ class Recommend(commands.Cog, name="recommend"):
         success, message = await self.add_rating(ctx.author, movie_title, rating)
         await ctx.send(message)
 
+    # Shows how fresh the recommendation model is
+    @commands.hybrid_command(
+        name="model_status",
+        description="Show the state of the recommendation model.",
+    )
+    async def model_status(self, ctx: commands.Context):
+        last_trained_at = self.retrain_scheduler.last_trained_at
+        embed = discord.Embed(title="Recommendation model", color=0xBEBEFE)
+        embed.add_field(name="Engine", value=self.algo.name if self.algo is not None else self.engine)
+        embed.add_field(
+            name="Last trained",
+            value=f"<t:{int(last_trained_at)}:R>" if last_trained_at else "Never",
+        )
+        embed.add_field(name="Training now", value="Yes" if self.training_worker.is_training else "No")
+        embed.add_field(name="Ratings waiting", value=str(self.retrain_scheduler.queue_depth))
+        await ctx.send(embed=embed)
+
     # Executes the discord command to provide a recommendation to the user based on a movie they appear to be asking about, requires user to already be registered via the add_user command
     @commands.hybrid_command(
         name="recommend",
@@ -135,45 +302,27 @@ class Recommend(commands.Cog, name="recommend"):
     async def recommend(self, ctx: commands.Context, *, partial_movie_name: str):
         discord_username = ctx.author.name
 
-        if discord_username not in self.username_mapping:
+        user_id = await self.resolve_user(ctx.author)
+        if user_id is None:
             await ctx.send("Discord user not found. Please register first.")
             return
 
-        user_id = self.username_mapping[discord_username]
-
-
-        client = OpenAI(
-            api_key=OPEN_AI_API_KEY, 
-        )
-
-        # Create a thread with the initial user message
-        thread = client.beta.threads.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": partial_movie_name
-                }
-            ]
-        )
-
-        # Start a run with the assistant
-        run = client.beta.threads.runs.create(
-            thread_id=thread.id,
-            assistant_id=OPEN_AI_ASSISTANTS_ID,
-        )
+        if self.algo is None:
+            await ctx.send("The recommendation model is still training, please try again in a moment.")
+            return
 
-        # Wait for the assistant's response
-        assistant_response = await self.wait_for_response(thread.id)
+        # Work out which movie the user is talking about, the assistant is only asked when neither the catalog nor the cache knows
+        assistant_response = await self.extract_movie_title(partial_movie_name)
 
         if not assistant_response:
             await ctx.send("No response from the assistant. Please try again later.")
             return
 
 
-        print("OpenAI's response from the bot: ", assistant_response[0].text.value)
+        print("OpenAI's response from the bot: ", assistant_response)
         
         # Process the assistant's response
-        closest_match = process.extractOne(assistant_response[0].text.value, self.movie_titles.keys(), score_cutoff=70)
+        closest_match = self.title_index.match(assistant_response)
         if not closest_match:
             embed = discord.Embed(
                 title="No close match found for the movie name. Please try again.",
@@ -182,24 +331,97 @@ class Recommend(commands.Cog, name="recommend"):
             await ctx.send(embed=embed)
             return
 
-        movie_name, movie_id = closest_match[0], self.movie_titles[closest_match[0]]
-        prediction = self.algo.predict(str(user_id), str(movie_id))
+        movie_name, movie_id = closest_match[0], closest_match[1]
+        prediction = self.algo.predict(user_id, movie_id)
 
         embed = discord.Embed(
             title=f"Closest match: '{movie_name}'",
-            description=f"Prediction for User '{discord_username}' on Movie '{movie_name}':\nRating Prediction: {prediction.est}",
+            description=f"Prediction for User '{discord_username}' on Movie '{movie_name}':\nRating Prediction: {prediction}",
             color=0x57F287,
         )
 
         await ctx.send(embed=embed)
 
-    async def wait_for_response(self, thread_id):
-        """Wait for the assistant's response in the given thread."""
-        for _ in range(30):  # Wait up to 30 seconds for a response
-            await asyncio.sleep(1)  # Correctly await the sleep
-            messages = client.beta.threads.messages.list(thread_id=thread_id)
-            if len(messages.data) > 1:  # Assuming the first message is the user's and the second is the assistant's
-                return messages.data[0].content  # Return the assistants content
+    # Turns a free-text question into a movie title, skipping the assistant when the query plainly names a movie or was asked before
+    async def extract_movie_title(self, query: str):
+        direct_match = self.title_index.match(query)
+        if direct_match and direct_match[2] >= self.precheck_score:
+            return direct_match[0]
+
+        cache_key = normalize_title(query)
+        title = self.intent_cache.get(cache_key)
+        if title is not None:
+            return title
+
+        try:
+            title = await self.assistant.extract_title(query)
+        except APIError as e:
+            self.bot.logger.warning(f"OpenAI assistant request failed: {e}")
+            return None
+        if title:
+            self.intent_cache.set(cache_key, title)
+        return title
+
+    # Executes the discord command to list the movies the user is predicted to like the most, requires user to already be registered
+    @commands.hybrid_command(
+        name="top_picks",
+        description="Get the movies you are most likely to enjoy that you haven't rated yet.",
+    )
+    async def top_picks(self, ctx: commands.Context, count: int = 10):
+        discord_username = ctx.author.name
+
+        user_id = await self.resolve_user(ctx.author)
+        if user_id is None:
+            await ctx.send("Discord user not found. Please register first.")
+            return
+
+        if self.algo is None:
+            await ctx.send("The recommendation model is still training, please try again in a moment.")
+            return
+
+        picks = self.algo.top_n(user_id, max(1, min(count, 25)))
+
+        embed = discord.Embed(
+            title=f"Top picks for '{discord_username}'",
+            description="\n".join(
+                f"{rank}. {self.movie_names.get(movie_id, f'Movie #{movie_id}')} - {estimate:.2f}"
+                for rank, (movie_id, estimate) in enumerate(picks, start=1)
+            ) or "You have already rated every movie!",
+            color=0x57F287,
+        )
+        await ctx.send(embed=embed)
+
+    # Executes the discord command to find movies similar to the given one, no registration needed
+    @commands.hybrid_command(
+        name="similar",
+        description="Get movies similar to the given movie.",
+    )
+    async def similar(self, ctx: commands.Context, *, movie_title: str):
+        if self.algo is None:
+            await ctx.send("The recommendation model is still training, please try again in a moment.")
+            return
+
+        closest_match = self.title_index.match(movie_title)
+        if not closest_match:
+            embed = discord.Embed(
+                title="No close match found for the movie name. Please try again.",
+                color=0xE02B2B,
+            )
+            await ctx.send(embed=embed)
+            return
+
+        movie_name, movie_id = closest_match[0], closest_match[1]
+        similar_movies = self.algo.similar_items(movie_id, 10)
+
+        embed = discord.Embed(
+            title=f"Movies similar to '{movie_name}'",
+            description="\n".join(
+                f"{rank}. {self.movie_names.get(similar_id, f'Movie #{similar_id}')}"
+                for rank, (similar_id, _) in enumerate(similar_movies, start=1)
+            ) or "Nobody has rated this movie yet.",
+            color=0x57F287,
+        )
+        await ctx.send(embed=embed)
 
 
 async def setup(bot) -> None:
@@ -7,12 +7,386 @@ Version: 6.1.0
 """
 
 
+import asyncio
+import contextlib
+import logging
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
 import aiosqlite
 
+logger = logging.getLogger("discord_bot.database")
+
+# Bumped whenever `migrate` learns a new step, stored in the database file with `PRAGMA user_version`
+SCHEMA_VERSION = 1
+
+# Applied to every connection. WAL lets readers run while a write is in progress, and with it
+# `synchronous=NORMAL` is still safe against corruption while only syncing at checkpoints.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=67108864",
+)
+
+
+async def connect(path: str, *, read_only: bool = False) -> aiosqlite.Connection:
+    """
+    This function will open a connection to the database and apply the pragmas every connection needs.
+
+    :param path: The path of the database file.
+    :param read_only: Refuse writes on this connection, for the readers of `DatabaseManager`.
+    :return: The open connection.
+    """
+    # Every query is a constant string, so the compiled statements are reused from the connection's cache
+    connection = await aiosqlite.connect(path, cached_statements=256)
+    try:
+        for pragma in PRAGMAS:
+            await connection.execute(pragma)
+        if read_only:
+            await connection.execute("PRAGMA query_only=1")
+    except BaseException:
+        await connection.close()
+        raise
+    return connection
+
+
+async def migrate(connection: aiosqlite.Connection) -> None:
+    """
+    This function will bring a database created by an older version of the bot up to date, it runs before the schema is applied.
+
+    :param connection: The connection to the database.
+    """
+    rows = await connection.execute("PRAGMA user_version")
+    async with rows as cursor:
+        version = (await cursor.fetchone())[0]
+    if version >= SCHEMA_VERSION:
+        return
+
+    if version < 1:
+        # Warn IDs used to be allocated with a separate SELECT, so concurrent warns could get the same ID.
+        # They are renumbered one by one to the end of their user's list before the unique index is created.
+        rows = await connection.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='warns'"
+        )
+        async with rows as cursor:
+            has_warns = await cursor.fetchone() is not None
+        if has_warns:
+            rows = await connection.execute(
+                "SELECT rowid FROM warns AS w WHERE EXISTS (SELECT 1 FROM warns AS o WHERE o.server_id=w.server_id AND o.user_id=w.user_id AND o.id=w.id AND o.rowid<w.rowid) ORDER BY rowid"
+            )
+            async with rows as cursor:
+                duplicates = await cursor.fetchall()
+            for (rowid,) in duplicates:
+                await connection.execute(
+                    "UPDATE warns SET id=(SELECT MAX(o.id) + 1 FROM warns AS o WHERE o.server_id=warns.server_id AND o.user_id=warns.user_id) WHERE rowid=?",
+                    (rowid,),
+                )
+
+    await connection.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+    await connection.commit()
+
+
+class WarningCache:
+    """
+    A size-bounded LRU cache of the warnings of each user on each server, keyed by `(server_id, user_id)`.
+
+    `DatabaseManager` writes through it: warns added or removed are applied to the cached list of
+    their user, if it is cached, once they are committed.
+    """
+
+    def __init__(self, *, max_size: int = 1024) -> None:
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple[str, str], tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(server_id: int, user_id: int) -> Tuple[str, str]:
+        # The IDs are stored as text, the same user must hit the same entry whether given as int or str
+        return str(server_id), str(user_id)
+
+    def get(self, key: Tuple[str, str]) -> Optional[tuple]:
+        rows = self._entries.get(key)
+        if rows is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return rows
+
+    def set(self, key: Tuple[str, str], rows: tuple) -> None:
+        self._entries[key] = rows
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def add(self, key: Tuple[str, str], row: tuple) -> None:
+        if key in self._entries:
+            self._entries[key] += (row,)
+
+    def remove(self, key: Tuple[str, str], warn_id: int) -> None:
+        if key in self._entries:
+            self._entries[key] = tuple(row for row in self._entries[key] if row[5] != warn_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+# A write to run in the current batch, it gets the connection and returns what the caller awaits
+Write = Callable[[aiosqlite.Connection], Awaitable[Any]]
+
 
 class DatabaseManager:
-    def __init__(self, *, connection: aiosqlite.Connection) -> None:
+    def __init__(
+        self,
+        *,
+        connection: aiosqlite.Connection,
+        readers: Sequence[aiosqlite.Connection] = (),
+        commit_delay: float = 0.005,
+        max_batch: int = 500,
+        warning_cache_size: int = 1024,
+    ) -> None:
+        """
+        Writes go through a queue: the writer task waits `commit_delay` seconds after the first
+        one, then runs everything queued meanwhile in a single transaction on `connection`, so a
+        burst of writes costs one commit instead of one each. Reads run right away on whichever
+        reader connection is idle, each reader has its own thread so they don't wait behind the
+        writes nor each other. In WAL mode readers only see committed writes, which a write's
+        caller never awaits before.
+
+        :param connection: The connection that writes to the database.
+        :param readers: The connections that read from the database, reads use `connection` if there are none.
+        :param commit_delay: How long, in seconds, a write waits for others to share its commit.
+        :param max_batch: The most writes committed together.
+        :param warning_cache_size: How many users' warnings are kept in memory.
+        """
         self.connection = connection
+        self.readers = list(readers)
+        self._idle_readers: asyncio.Queue = asyncio.Queue()
+        for reader in self.readers:
+            self._idle_readers.put_nowait(reader)
+        self.commit_delay = commit_delay
+        self.max_batch = max_batch
+        self._writes: asyncio.Queue = asyncio.Queue()
+        self._writer: Optional[asyncio.Task] = None
+        self._closed = False
+        self.warning_cache = WarningCache(max_size=warning_cache_size)
+        # Bumped by every committed warn change, a list read from the database meanwhile may be stale and isn't cached
+        self._warn_writes = 0
+        # The blacklisted user IDs, checked before every command, filled by `load_blacklist`
+        self.blacklist: Set[int] = set()
+
+    @classmethod
+    async def open(cls, path: str, *, readers: int = 2, **kwargs: Any) -> "DatabaseManager":
+        """
+        This function will open the writer and the reader connections to a database, and load the blacklist.
+
+        :param path: The path of the database file.
+        :param readers: How many reader connections to open.
+        :param kwargs: The other settings of `DatabaseManager`.
+        """
+        connections = []
+        try:
+            connections.append(await connect(path))
+            for _ in range(readers):
+                connections.append(await connect(path, read_only=True))
+            manager = cls(connection=connections[0], readers=connections[1:], **kwargs)
+            await manager.load_blacklist()
+        except BaseException:
+            # An open connection keeps its thread alive, which would stop the process from exiting
+            for connection in connections:
+                await connection.close()
+            raise
+        return manager
+
+    @contextlib.asynccontextmanager
+    async def _reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        This function will lend an idle reader connection until the block exits.
+        """
+        if not self.readers:
+            yield self.connection
+            return
+        connection = await self._idle_readers.get()
+        try:
+            yield connection
+        finally:
+            self._idle_readers.put_nowait(connection)
+
+    async def _write(self, write: Write) -> Any:
+        """
+        This function will queue a write and wait until the transaction it is part of is committed.
+
+        :param write: The write, run with the connection once its batch starts.
+        :return: What the write returned.
+        """
+        if self._closed:
+            raise RuntimeError("The database is closed")
+        # Started on the first write, and started again should it ever have stopped
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_loop())
+        future = asyncio.get_running_loop().create_future()
+        self._writes.put_nowait((write, future))
+        return await future
+
+    async def _write_loop(self) -> None:
+        while True:
+            batch = [await self._writes.get()]
+            # Writes coming in meanwhile share the commit
+            await asyncio.sleep(self.commit_delay)
+            while len(batch) < self.max_batch and not self._writes.empty():
+                batch.append(self._writes.get_nowait())
+            try:
+                await self._commit(batch)
+            except Exception as e:
+                # The callers already got the error, the writer keeps going for the next batch
+                logger.error(f"Failed to commit {len(batch)} database writes: {type(e).__name__}: {e}")
+            finally:
+                for _ in batch:
+                    self._writes.task_done()
+
+    async def _commit(self, batch: List[Tuple[Write, asyncio.Future]]) -> None:
+        """
+        This function will run a batch of writes in one transaction. A write that fails is rolled back on its own and its caller gets the error, the others are still committed.
+
+        :param batch: The writes and the futures of their callers.
+        """
+        results: List[Tuple[Any, Optional[Exception]]] = []
+        failure: Optional[Exception] = None
+        try:
+            # Left over from a batch whose rollback failed
+            if self.connection.in_transaction:
+                await self.connection.rollback()
+            await self.connection.execute("BEGIN")
+            for write, _ in batch:
+                await self.connection.execute("SAVEPOINT write")
+                try:
+                    results.append((await write(self.connection), None))
+                except Exception as e:
+                    await self.connection.execute("ROLLBACK TO write")
+                    results.append((None, e))
+                await self.connection.execute("RELEASE write")
+            await self.connection.commit()
+        except Exception as e:
+            failure = e
+            await self.connection.rollback()
+            raise
+        finally:
+            # Every caller is answered, even when the rollback fails too or the writer is cancelled
+            for index, (_, future) in enumerate(batch):
+                if future.done():
+                    continue
+                if failure is not None:
+                    future.set_exception(failure)
+                elif index < len(results) and len(results) == len(batch):
+                    result, error = results[index]
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(result)
+                else:
+                    future.cancel()
+
+    async def flush(self) -> None:
+        """
+        This function will wait until every queued write is committed.
+        """
+        await self._writes.join()
+
+    async def close(self) -> None:
+        """
+        This function will commit the queued writes, then close every connection. Writes after this fail.
+        """
+        self._closed = True
+        await self.flush()
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+        await self.connection.close()
+        for reader in self.readers:
+            await reader.close()
+
+    async def load_blacklist(self) -> None:
+        """
+        This function will load every blacklisted user ID into memory, `add_user_to_blacklist` and `remove_user_from_blacklist` keep it in sync afterwards.
+        """
+        async with self._reader() as connection:
+            rows = await connection.execute("SELECT user_id FROM blacklist")
+            async with rows as cursor:
+                self.blacklist = {int(row[0]) for row in await cursor.fetchall()}
+
+    async def get_blacklisted_users(self) -> list:
+        """
+        This function will get all the blacklisted users.
+
+        :return: A list of `(user_id, created_at)` tuples, the timestamps in seconds.
+        """
+        async with self._reader() as connection:
+            rows = await connection.execute(
+                "SELECT user_id, strftime('%s', created_at) FROM blacklist ORDER BY created_at"
+            )
+            async with rows as cursor:
+                return await cursor.fetchall()
+
+    async def is_blacklisted(self, user_id: int) -> bool:
+        """
+        This function will check if a user is blacklisted, from memory.
+
+        :param user_id: The ID of the user that should be checked.
+        :return: True if the user is blacklisted, False if not.
+        """
+        return int(user_id) in self.blacklist
+
+    async def add_user_to_blacklist(self, user_id: int) -> int:
+        """
+        This function will add a user based on its ID in the blacklist.
+
+        :param user_id: The ID of the user that should be added into the blacklist.
+        :return: The number of blacklisted users.
+        """
+
+        async def write(connection: aiosqlite.Connection) -> int:
+            await connection.execute(
+                "INSERT OR IGNORE INTO blacklist(user_id) VALUES (?)", (str(user_id),)
+            )
+            rows = await connection.execute("SELECT COUNT(*) FROM blacklist")
+            async with rows as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result is not None else 0
+
+        total = await self._write(write)
+        self.blacklist.add(int(user_id))
+        return total
+
+    async def remove_user_from_blacklist(self, user_id: int) -> int:
+        """
+        This function will remove a user based on its ID from the blacklist.
+
+        :param user_id: The ID of the user that should be removed from the blacklist.
+        :return: The number of blacklisted users.
+        """
+
+        async def write(connection: aiosqlite.Connection) -> int:
+            await connection.execute(
+                "DELETE FROM blacklist WHERE user_id=?", (str(user_id),)
+            )
+            rows = await connection.execute("SELECT COUNT(*) FROM blacklist")
+            async with rows as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result is not None else 0
+
+        total = await self._write(write)
+        self.blacklist.discard(int(user_id))
+        return total
 
     async def add_warn(
         self, user_id: int, server_id: int, moderator_id: int, reason: str
@@ -23,28 +397,27 @@ class DatabaseManager:
         :param user_id: The ID of the user that should be warned.
         :param reason: The reason why the user should be warned.
         """
-        rows = await self.connection.execute(
-            "SELECT id FROM warns WHERE user_id=? AND server_id=? ORDER BY id DESC LIMIT 1",
-            (
-                user_id,
-                server_id,
-            ),
-        )
-        async with rows as cursor:
-            result = await cursor.fetchone()
-            warn_id = result[0] + 1 if result is not None else 1
-            await self.connection.execute(
-                "INSERT INTO warns(id, user_id, server_id, moderator_id, reason) VALUES (?, ?, ?, ?, ?)",
+
+        async def write(connection: aiosqlite.Connection) -> tuple:
+            # The next ID is picked and inserted in one statement, two moderators warning at once can't get the same ID
+            rows = await connection.execute(
+                "INSERT INTO warns(id, user_id, server_id, moderator_id, reason) SELECT COALESCE(MAX(id), 0) + 1, ?, ?, ?, ? FROM warns WHERE user_id=? AND server_id=? RETURNING user_id, server_id, moderator_id, reason, strftime('%s', created_at), id",
                 (
-                    warn_id,
                     user_id,
                     server_id,
                     moderator_id,
                     reason,
+                    user_id,
+                    server_id,
                 ),
             )
-            await self.connection.commit()
-            return warn_id
+            async with rows as cursor:
+                return await cursor.fetchone()
+
+        row = await self._write(write)
+        self._warn_writes += 1
+        self.warning_cache.add(WarningCache.key(server_id, user_id), row)
+        return row[5]
 
     async def remove_warn(self, warn_id: int, user_id: int, server_id: int) -> int:
         """
@@ -54,44 +427,213 @@ class DatabaseManager:
         :param user_id: The ID of the user that was warned.
         :param server_id: The ID of the server where the user has been warned
         """
-        await self.connection.execute(
-            "DELETE FROM warns WHERE id=? AND user_id=? AND server_id=?",
-            (
-                warn_id,
-                user_id,
-                server_id,
-            ),
-        )
-        await self.connection.commit()
-        rows = await self.connection.execute(
-            "SELECT COUNT(*) FROM warns WHERE user_id=? AND server_id=?",
-            (
-                user_id,
-                server_id,
-            ),
-        )
-        async with rows as cursor:
-            result = await cursor.fetchone()
-            return result[0] if result is not None else 0
+
+        async def write(connection: aiosqlite.Connection) -> int:
+            await connection.execute(
+                "DELETE FROM warns WHERE id=? AND user_id=? AND server_id=?",
+                (
+                    warn_id,
+                    user_id,
+                    server_id,
+                ),
+            )
+            rows = await connection.execute(
+                "SELECT COUNT(*) FROM warns WHERE user_id=? AND server_id=?",
+                (
+                    user_id,
+                    server_id,
+                ),
+            )
+            async with rows as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result is not None else 0
+
+        total = await self._write(write)
+        self._warn_writes += 1
+        self.warning_cache.remove(WarningCache.key(server_id, user_id), warn_id)
+        return total
 
     async def get_warnings(self, user_id: int, server_id: int) -> list:
         """
-        This function will get all the warnings of a user.
+        This function will get all the warnings of a user, from memory if they were read before.
 
         :param user_id: The ID of the user that should be checked.
         :param server_id: The ID of the server that should be checked.
         :return: A list of all the warnings of the user.
         """
-        rows = await self.connection.execute(
-            "SELECT user_id, server_id, moderator_id, reason, strftime('%s', created_at), id FROM warns WHERE user_id=? AND server_id=?",
-            (
-                user_id,
-                server_id,
-            ),
+        return list(await self._cached_warnings(user_id, server_id))
+
+    async def get_warning_count(self, user_id: int, server_id: int) -> int:
+        """
+        This function will get the number of warnings of a user.
+
+        :param user_id: The ID of the user that should be checked.
+        :param server_id: The ID of the server that should be checked.
+        :return: The number of warnings of the user.
+        """
+        return len(await self._cached_warnings(user_id, server_id))
+
+    async def _cached_warnings(self, user_id: int, server_id: int) -> tuple:
+        key = WarningCache.key(server_id, user_id)
+        rows = self.warning_cache.get(key)
+        if rows is not None:
+            return rows
+        writes = self._warn_writes
+        async with self._reader() as connection:
+            rows = await connection.execute(
+                "SELECT user_id, server_id, moderator_id, reason, strftime('%s', created_at), id FROM warns WHERE user_id=? AND server_id=? ORDER BY id",
+                (
+                    user_id,
+                    server_id,
+                ),
+            )
+            async with rows as cursor:
+                rows = tuple(await cursor.fetchall())
+        if writes == self._warn_writes:
+            self.warning_cache.set(key, rows)
+        return rows
+
+    async def add_recommender_user(
+        self, user_id: int, discord_user_id: int, discord_username: str
+    ) -> None:
+        """
+        This function will register a Discord user in the recommendation system.
+
+        :param user_id: The ID of the user in the recommendation system.
+        :param discord_user_id: The ID of the Discord user.
+        :param discord_username: The name of the Discord user.
+        """
+        await self._write(
+            lambda connection: connection.execute(
+                "INSERT INTO recommender_users(user_id, discord_user_id, discord_username) VALUES (?, ?, ?)",
+                (
+                    user_id,
+                    str(discord_user_id),
+                    discord_username,
+                ),
+            )
         )
-        async with rows as cursor:
-            result = await cursor.fetchall()
-            result_list = []
-            for row in result:
-                result_list.append(row)
-            return result_list
+
+    async def update_recommender_username(self, user_id: int, discord_username: str) -> None:
+        """
+        This function will update the stored name of a registered Discord user, after they renamed themselves.
+
+        :param user_id: The ID of the user in the recommendation system.
+        :param discord_username: The new name of the Discord user.
+        """
+        await self._write(
+            lambda connection: connection.execute(
+                "UPDATE recommender_users SET discord_username=? WHERE user_id=?",
+                (
+                    discord_username,
+                    user_id,
+                ),
+            )
+        )
+
+    async def import_recommender_users(self, users: list) -> None:
+        """
+        This function will add users in bulk, keeping their existing IDs. Users that already exist are skipped.
+
+        :param users: A list of `(user_id, discord_user_id, discord_username)` tuples, the Discord fields can be `None`.
+        """
+        await self._write(
+            lambda connection: connection.executemany(
+                "INSERT OR IGNORE INTO recommender_users(user_id, discord_user_id, discord_username) VALUES (?, ?, ?)",
+                users,
+            )
+        )
+
+    async def get_recommender_users(self) -> list:
+        """
+        This function will get all the Discord users registered in the recommendation system.
+
+        :return: A list of `(user_id, discord_user_id, discord_username)` tuples.
+        """
+        async with self._reader() as connection:
+            rows = await connection.execute(
+                "SELECT user_id, discord_user_id, discord_username FROM recommender_users WHERE discord_user_id IS NOT NULL"
+            )
+            async with rows as cursor:
+                return await cursor.fetchall()
+
+    async def get_max_recommender_user_id(self) -> int:
+        """
+        This function will get the highest user ID in the recommendation system, including users without a Discord account.
+
+        :return: The highest user ID, 0 if there are no users.
+        """
+        async with self._reader() as connection:
+            rows = await connection.execute("SELECT MAX(user_id) FROM recommender_users")
+            async with rows as cursor:
+                result = await cursor.fetchone()
+                return result[0] or 0
+
+    async def add_rating(self, user_id: int, movie_id: int, rating: float) -> None:
+        """
+        This function will add a movie rating to the database.
+
+        :param user_id: The ID of the user in the recommendation system.
+        :param movie_id: The ID of the rated movie.
+        :param rating: The rating the user gave.
+        :return: The rowid of the new rating.
+        """
+
+        async def write(connection: aiosqlite.Connection) -> int:
+            rows = await connection.execute(
+                "INSERT INTO ratings(user_id, movie_id, rating, timestamp) VALUES (?, ?, ?, strftime('%s', 'now')) RETURNING rowid",
+                (
+                    user_id,
+                    movie_id,
+                    rating,
+                ),
+            )
+            async with rows as cursor:
+                return (await cursor.fetchone())[0]
+
+        return await self._write(write)
+
+    async def get_last_rating_rowid(self) -> int:
+        """
+        This function will get the rowid of the newest rating, ratings are never deleted so every older one has a smaller rowid.
+
+        :return: The rowid, 0 if there are no ratings.
+        """
+        async with self._reader() as connection:
+            rows = await connection.execute("SELECT MAX(rowid) FROM ratings")
+            async with rows as cursor:
+                result = await cursor.fetchone()
+                return result[0] or 0
+
+    async def import_ratings(self, ratings: list) -> None:
+        """
+        This function will add ratings in bulk, in a single transaction.
+
+        :param ratings: A list of `(user_id, movie_id, rating, timestamp)` tuples.
+        """
+        await self._write(
+            lambda connection: connection.executemany(
+                "INSERT INTO ratings(user_id, movie_id, rating, timestamp) VALUES (?, ?, ?, ?)",
+                ratings,
+            )
+        )
+
+    async def iter_ratings(self, chunk_size: int = 100000, after_rowid: int = 0):
+        """
+        This function will get every rating, which is the training set of the recommendation model, a chunk at a time.
+
+        :param chunk_size: The maximum number of ratings per chunk.
+        :param after_rowid: Only get the ratings added after the one with this rowid.
+        :return: An async iterator of lists of `(user_id, movie_id, rating, timestamp)` tuples.
+        """
+        async with self._reader() as connection:
+            rows = await connection.execute(
+                "SELECT user_id, movie_id, rating, COALESCE(timestamp, 0) FROM ratings WHERE rowid > ? ORDER BY rowid",
+                (after_rowid,),
+            )
+            async with rows as cursor:
+                while True:
+                    chunk = await cursor.fetchmany(chunk_size)
+                    if not chunk:
+                        return
+                    yield chunk
@@ -5,4 +5,29 @@ CREATE TABLE IF NOT EXISTS `warns` (
   `moderator_id` varchar(20) NOT NULL,
   `reason` varchar(255) NOT NULL,
   `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
-);
\ No newline at end of file
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS `idx_warns_server_user_id` ON `warns` (`server_id`, `user_id`, `id`);
+
+CREATE TABLE IF NOT EXISTS `recommender_users` (
+  `user_id` INTEGER PRIMARY KEY,
+  `discord_user_id` varchar(20) DEFAULT NULL,
+  `discord_username` varchar(255) DEFAULT NULL,
+  `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS `idx_recommender_users_discord_user_id` ON `recommender_users` (`discord_user_id`);
+
+CREATE TABLE IF NOT EXISTS `ratings` (
+  `user_id` int(11) NOT NULL,
+  `movie_id` int(11) NOT NULL,
+  `rating` real NOT NULL,
+  `timestamp` int(11) NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS `idx_ratings_user_id` ON `ratings` (`user_id`, `movie_id`);
+
+CREATE TABLE IF NOT EXISTS `blacklist` (
+  `user_id` varchar(20) NOT NULL PRIMARY KEY,
+  `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
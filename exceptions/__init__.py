@@ -0,0 +1,19 @@
+""""
+Copyright © Krypton 2019-2023 - https://github.com/kkrypt0nn (https://krypton.ninja)
+Description:
+🐍 A simple template to start to code your own and personalized discord bot in Python programming language.
+
+Version: 6.1.0
+"""
+
+from discord.ext import commands
+
+
+class UserBlacklisted(commands.CheckFailure):
+    """
+    Thrown when a user is attempting something, but is blacklisted.
+    """
+
+    def __init__(self, message="User is blacklisted!"):
+        self.message = message
+        super().__init__(self.message)
@@ -0,0 +1,47 @@
+"""
+Building blocks for the movie recommender used by the `recommend` cog.
+
+Everything in this package is free of Discord dependencies so it can be used
+from scripts as well as from the bot.
+"""
+
+from .als import ALSModel
+from .assistant import AssistantClient
+from .cache import TTLCache
+from .datasets import DATASETS, MovieLensDataset, SyntheticDataset, get_dataset
+from .engines import ENGINES, Engine, get_engine
+from .knn import ItemKNNModel
+from .model import FactorModel
+from .scheduler import RetrainScheduler
+from .snapshot import load_snapshot, ratings_fingerprint, save_snapshot
+from .store import MappedRatingStore, RatingStore
+from .titles import TitleIndex, normalize_title
+from .training import TrainingWorker, build_trainset, fit_model
+from .users import UserRegistry
+
+__all__ = [
+    "DATASETS",
+    "ENGINES",
+    "ALSModel",
+    "AssistantClient",
+    "Engine",
+    "FactorModel",
+    "ItemKNNModel",
+    "MappedRatingStore",
+    "MovieLensDataset",
+    "RatingStore",
+    "RetrainScheduler",
+    "SyntheticDataset",
+    "TTLCache",
+    "TitleIndex",
+    "TrainingWorker",
+    "UserRegistry",
+    "build_trainset",
+    "fit_model",
+    "get_dataset",
+    "get_engine",
+    "load_snapshot",
+    "normalize_title",
+    "ratings_fingerprint",
+    "save_snapshot",
+]
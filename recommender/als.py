@@ -0,0 +1,106 @@
+import inspect
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from .engines import register_engine
+from .model import FactorModel, solve_rows, to_csr
+
+
+@register_engine
+class ALSModel(FactorModel):
+    """
+    The `als` engine: the same latent factor model as `svd`, fitted with alternating least squares.
+
+    With one side fixed, the factors of every user (or item) are an independent ridge regression,
+    so each half-step is a batch of small solves whose stacked solves run on a thread pool, see
+    `solve_rows`. In explicit mode the biases are fitted together with the factors. In implicit
+    mode every rating is a positive signal with confidence `1 + alpha * rating`, scores then rank
+    items rather than estimate ratings, and `predict` maps them onto the rating scale.
+    """
+
+    name = "als"
+
+    def __init__(self, *, implicit: bool = False, alpha: float = 40.0, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.implicit = implicit
+        self.alpha = alpha
+
+    @classmethod
+    def fit(
+        cls,
+        users: np.ndarray,
+        items: np.ndarray,
+        ratings: np.ndarray,
+        *,
+        rating_scale: Tuple[float, float] = (1, 5),
+        n_neighbors: int = 20,
+        n_factors: int = 50,
+        n_epochs: int = 15,
+        reg: float = 0.1,
+        implicit: bool = False,
+        alpha: float = 40.0,
+        init_std: float = 0.1,
+        workers: Optional[int] = None,
+        random_state: Optional[int] = None,
+    ) -> "ALSModel":
+        """
+        Fit the model with `n_epochs` rounds of solving the user side, then the item side.
+
+        :param workers: How many threads solve at once, every core by default.
+        """
+        user_ids, inner_users = np.unique(users, return_inverse=True)
+        item_ids, inner_items = np.unique(items, return_inverse=True)
+        values = np.asarray(ratings, dtype=np.float64)
+        by_user = to_csr(inner_users, inner_items, values, len(user_ids))
+        by_item = to_csr(inner_items, inner_users, values, len(item_ids))
+
+        rng = np.random.default_rng(random_state)
+        pu = rng.normal(0, init_std, (len(user_ids), n_factors))
+        qi = rng.normal(0, init_std, (len(item_ids), n_factors))
+        bu = np.zeros(len(user_ids))
+        bi = np.zeros(len(item_ids))
+        mean = 0.0 if implicit else float(values.mean())
+        with ThreadPoolExecutor(workers or os.cpu_count(), thread_name_prefix="recommender-als") as pool:
+            for _ in range(n_epochs):
+                pu, bu = solve_rows(*by_user, qi, bi, mean, reg, implicit, alpha, pool)
+                qi, bi = solve_rows(*by_item, pu, bu, mean, reg, implicit, alpha, pool)
+
+        model = cls(
+            pu=pu,
+            qi=qi,
+            bu=bu,
+            bi=bi,
+            global_mean=mean,
+            user_ids=user_ids.astype(np.int64),
+            item_ids=item_ids.astype(np.int64),
+            rating_scale=rating_scale,
+            lr=0.0,
+            reg=reg,
+            n_epochs=n_epochs,
+            init_std=init_std,
+            implicit=implicit,
+            alpha=alpha,
+        )
+        model.build_similarity_index(n_neighbors)
+        return model
+
+    @classmethod
+    def _options_signature(cls, options: Dict[str, Any]) -> inspect.Signature:
+        return inspect.signature(cls.fit)
+
+    def params(self) -> Dict[str, Any]:
+        return {**super().params(), "implicit": self.implicit, "alpha": self.alpha}
+
+    def _solve(
+        self, by_row: Tuple[np.ndarray, ...], other: np.ndarray, other_bias: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        return solve_rows(*by_row, other, other_bias, self.global_mean, self.reg, self.implicit, self.alpha)
+
+    def clip(self, estimate: float) -> float:
+        if self.implicit:
+            low, high = self.rating_scale
+            estimate = low + (high - low) * estimate
+        return super().clip(estimate)
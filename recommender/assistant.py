@@ -0,0 +1,101 @@
+import asyncio
+import time
+from typing import Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+# Run states after which the run will not change anymore
+FINISHED_RUN_STATUSES = {"completed", "failed", "cancelled", "expired", "requires_action"}
+
+
+class AssistantClient:
+    """
+    Asks the OpenAI assistant which movie a free-text message is about, without blocking the event loop.
+
+    One pooled HTTP session is shared by every request, and at most `max_concurrency` conversations
+    with the assistant are in flight at once. Point `base_url` at a local stub server to test
+    without the real API.
+    """
+
+    def __init__(
+        self,
+        *,
+        api_key: str,
+        assistant_id: str,
+        base_url: Optional[str] = None,
+        timeout: float = 30.0,
+        connect_timeout: float = 5.0,
+        max_connections: int = 10,
+        max_concurrency: int = 5,
+        max_retries: int = 2,
+        response_timeout: float = 30.0,
+        poll_initial: float = 0.05,
+        poll_max: float = 1.0,
+    ) -> None:
+        self.assistant_id = assistant_id
+        self.response_timeout = response_timeout
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        )
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=max_retries,
+            http_client=self._http,
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def extract_title(self, text: str) -> Optional[str]:
+        """
+        Send the user's message to the assistant and return its answer.
+
+        :param text: What the user asked.
+        :return: The movie title the assistant extracted, or `None` if it didn't answer in time.
+        """
+        async with self._semaphore:
+            # Create the thread with the user's message and start the run in a single request
+            run = await self.client.beta.threads.create_and_run(
+                assistant_id=self.assistant_id,
+                thread={"messages": [{"role": "user", "content": text}]},
+            )
+
+            run = await self.wait_for_run(run)
+            if run is None or run.status != "completed":
+                return None
+
+            # Only the newest message is needed, which is the assistant's answer
+            messages = await self.client.beta.threads.messages.list(thread_id=run.thread_id, order="desc", limit=1)
+            if not messages.data or messages.data[0].role != "assistant":
+                return None
+            return messages.data[0].content[0].text.value
+
+    async def wait_for_run(self, run):
+        """
+        Wait until the run has finished, polling its status with exponential backoff.
+
+        The first checks come after a few tens of milliseconds so quick answers are picked up
+        quickly, slow ones are then checked at most every `poll_max` seconds.
+
+        :param run: The run that was just started.
+        :return: The finished run, or `None` if it didn't finish within `response_timeout` seconds.
+        """
+        deadline = time.monotonic() + self.response_timeout
+        delay = self.poll_initial
+        while run.status not in FINISHED_RUN_STATUSES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, self.poll_max)
+            run = await self.client.beta.threads.runs.retrieve(run.id, thread_id=run.thread_id)
+        return run
+
+    async def close(self) -> None:
+        """
+        Close the pooled HTTP session.
+        """
+        await self.client.close()
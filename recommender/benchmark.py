@@ -0,0 +1,335 @@
+"""
+Offline benchmark of the recommender pipeline, without Discord, the database or OpenAI.
+
+Every stage the `recommend` cog runs is timed on its own, the way the cog runs it: loading the
+movie titles and building the title index, loading the users, building and mapping the rating
+store, retraining the model, and answering fuzzy title matches, predictions, top picks and
+similar movies. Each stage reports its p50 and p95 latency, its throughput and the peak RSS of
+the process once it is done. Peak RSS never goes down, so a stage that does not raise it did not
+need more memory than the ones before it.
+
+Run it on MovieLens and synthetic datasets of any size, and keep the JSON results to compare the
+next version against::
+
+    python -m recommender.benchmark ml-100k synthetic-1000000 --output before.json
+    python -m recommender.benchmark ml-100k synthetic-1000000 --compare before.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+import numpy as np
+
+from .datasets import get_dataset
+from .engines import get_engine
+from .snapshot import load_snapshot, ratings_fingerprint
+from .store import MappedRatingStore
+from .titles import TitleIndex
+from .training import fit_model
+from .users import UserRegistry
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger("discord_bot.recommender")
+
+DEFAULT_DATASETS = ("ml-100k", "synthetic-100000", "synthetic-1000000")
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    The highest resident set size of this process so far, in MiB, `None` where it can't be measured.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes everywhere else
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+def misspell(title: str, rng: random.Random) -> str:
+    """
+    Turn a title into the kind of query users type: lower case, no year, often partial, with a typo.
+    """
+    words = title.rsplit(" (", 1)[0].lower().split()
+    if len(words) > 2 and rng.random() < 0.5:
+        words = words[: rng.randint(2, len(words) - 1)]
+    query = " ".join(words)
+    if len(query) > 4:
+        position = rng.randrange(1, len(query) - 1)
+        if rng.random() < 0.5:
+            query = query[:position] + query[position + 1 :]
+        else:
+            query = query[:position] + query[position + 1] + query[position] + query[position + 2 :]
+    return query
+
+
+class StageTimer:
+    """
+    Collects the latency of every call of every stage, and summarizes them.
+    """
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, Dict[str, Any]] = {}
+
+    def measure(
+        self, stage: str, function: Callable[[], Any], units: Union[int, Callable[[Any], int]], unit: str, repeat: int = 1
+    ) -> Any:
+        """
+        Time a whole-dataset stage `repeat` times.
+
+        :param units: How much work one call does, e.g. the number of ratings it goes through, or a
+            function that tells from what the call returned.
+        :param unit: What `units` counts, for the throughput.
+        :return: What the last call returned.
+        """
+        result = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - start
+            self._record(stage, elapsed, units(result) if callable(units) else units, unit)
+        return result
+
+    def measure_each(self, stage: str, function: Callable[[Any], Any], inputs: Iterable[Any], unit: str) -> None:
+        """
+        Time a request-sized stage once per input, e.g. once per query.
+        """
+        for value in inputs:
+            start = time.perf_counter()
+            function(value)
+            self._record(stage, time.perf_counter() - start, 1, unit)
+
+    def _record(self, stage: str, seconds: float, units: int, unit: str) -> None:
+        entry = self.stages.setdefault(stage, {"unit": unit, "seconds": [], "units": 0})
+        entry["seconds"].append(seconds)
+        entry["units"] += units
+        entry["peak_rss_mb"] = peak_rss_mb()
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """
+        :return: The calls, p50, p95 and mean latency in milliseconds, throughput in units per second
+            and peak RSS of every stage, in the order they ran.
+        """
+        summary = {}
+        for stage, entry in self.stages.items():
+            seconds = np.array(entry["seconds"])
+            total = float(seconds.sum())
+            p50, p95 = np.percentile(seconds, [50, 95]) * 1000
+            summary[stage] = {
+                "calls": len(seconds),
+                "p50_ms": round(float(p50), 4),
+                "p95_ms": round(float(p95), 4),
+                "mean_ms": round(float(seconds.mean()) * 1000, 4),
+                "throughput": round(entry["units"] / total, 2) if total > 0 else None,
+                "unit": f"{entry['unit']}/s",
+                "peak_rss_mb": None if entry["peak_rss_mb"] is None else round(entry["peak_rss_mb"], 1),
+            }
+        return summary
+
+
+def benchmark_dataset(
+    name: str,
+    path: Optional[str],
+    engine: str,
+    engine_options: Dict[str, Any],
+    repeat: int,
+    queries: int,
+    seed: int = 0,
+) -> Optional[Dict[str, Any]]:
+    """
+    Run every stage of the pipeline on one dataset.
+
+    :param name: A MovieLens release or `synthetic-<number of ratings>`.
+    :param path: The folder of the MovieLens release, defaults to its name.
+    :param engine: The recommender engine to train.
+    :param engine_options: Settings passed on to the engine.
+    :param repeat: How many times the whole-dataset stages run.
+    :param queries: How many requests the request-sized stages answer.
+    :return: The summary of every stage, or `None` if the dataset is missing.
+    """
+    dataset = get_dataset(name, path)
+    if not dataset.exists:
+        logger.warning(f"Skipping {name}, its files are not there")
+        return None
+    rng = random.Random(seed)
+    timer = StageTimer()
+
+    def load_movie_titles():
+        movie_names = dataset.load_movies()
+        movie_titles = {title: movie_id for movie_id, title in movie_names.items()}
+        return movie_titles, movie_names, TitleIndex(movie_names.items())
+
+    _, movie_names, title_index = timer.measure("load_movie_titles", load_movie_titles, 1, "catalogs", repeat)
+    user_rows = dataset.read_users()
+    timer.measure("load_users", lambda: UserRegistry.from_rows(user_rows), len(user_rows), "users", repeat)
+
+    with tempfile.TemporaryDirectory(prefix="recommender-benchmark-") as directory:
+        ratings_dir = os.path.join(directory, "ratings")
+
+        # Like the cog's first start: built next to its final place, then renamed
+        def build_store():
+            shutil.rmtree(ratings_dir, ignore_errors=True)
+            store = MappedRatingStore.build(f"{ratings_dir}.build", dataset.iter_ratings())
+            os.replace(f"{ratings_dir}.build", ratings_dir)
+            return len(store)
+
+        def load_data():
+            store = MappedRatingStore.open(ratings_dir)
+            columns = store.columns()
+            return store, columns, ratings_fingerprint(*columns)
+
+        n_ratings = timer.measure("build_store", build_store, lambda count: count, "ratings", repeat)
+        store, (users, items, ratings), _ = timer.measure("load_data", load_data, n_ratings, "ratings", repeat)
+        logger.info(f"{name}: {store.describe()}")
+
+        snapshot_dir = os.path.join(directory, "model")
+        timer.measure(
+            "retrain_model",
+            lambda: fit_model(
+                users,
+                items,
+                ratings,
+                snapshot_dir,
+                rating_scale=dataset.rating_scale,
+                engine=engine,
+                engine_options=engine_options,
+            ),
+            n_ratings,
+            "ratings",
+            repeat,
+        )
+        algo, _ = timer.measure("load_snapshot", lambda: load_snapshot(snapshot_dir), 1, "models", repeat)
+        algo.history = store.user_ratings
+
+        # Fuzzy matching runs uncached, the cache would only measure dictionary lookups
+        titles = list(movie_names.values())
+        title_queries = [misspell(rng.choice(titles), rng) for _ in range(queries)]
+        title_index.match.cache_clear()
+        timer.measure_each("fuzzy_match", title_index._match, title_queries, "queries")
+
+        user_ids = np.unique(users).tolist()
+        item_ids = algo.item_ids.tolist()
+        pairs = [(rng.choice(user_ids), rng.choice(item_ids)) for _ in range(queries)]
+        timer.measure_each("predict", lambda pair: algo.predict(*pair), pairs, "predictions")
+        timer.measure_each("top_n", algo.top_n, [rng.choice(user_ids) for _ in range(queries)], "requests")
+        timer.measure_each("similar_items", algo.similar_items, [rng.choice(item_ids) for _ in range(queries)], "requests")
+        del algo, store, users, items, ratings
+
+    return {"ratings": n_ratings, "movies": len(movie_names), "users": len(user_rows), "stages": timer.summary()}
+
+
+def environment() -> Dict[str, Any]:
+    """
+    What the numbers were measured on, results are only comparable on the same machine.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Log the p50 of every stage against a previous run.
+
+    :param tolerance: How much slower a stage may get before it counts as a regression, e.g. 0.2 for 20%.
+    :return: The regressions, as `dataset/stage` names.
+    """
+    regressions = []
+    logger.info(f"Compared to {baseline['environment'].get('commit') or 'the baseline'}:")
+    for name, result in results["datasets"].items():
+        old_stages = baseline["datasets"].get(name, {}).get("stages", {})
+        for stage, summary in result["stages"].items():
+            old = old_stages.get(stage)
+            if not old or not old["p50_ms"]:
+                continue
+            change = summary["p50_ms"] / old["p50_ms"] - 1
+            flag = ""
+            if change > tolerance:
+                regressions.append(f"{name}/{stage}")
+                flag = "  <- slower"
+            logger.info(f"  {name:<20} {stage:<18} {old['p50_ms']:>10.3f} -> {summary['p50_ms']:>10.3f} ms {change:>+7.1%}{flag}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time every stage of the recommender pipeline.")
+    parser.add_argument(
+        "datasets",
+        nargs="*",
+        default=list(DEFAULT_DATASETS),
+        help="MovieLens releases or synthetic-<number of ratings> datasets, missing releases are skipped.",
+    )
+    parser.add_argument("--path", help="The folder of the MovieLens release, when benchmarking a single one.")
+    parser.add_argument("--engine", default="svd", help="The recommender engine to train.")
+    parser.add_argument("--engine-options", default="{}", help="The engine settings, as JSON.")
+    parser.add_argument("--repeat", type=int, default=3, help="How many times the whole-dataset stages run.")
+    parser.add_argument("--queries", type=int, default=1000, help="How many requests the per-request stages answer.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="A previous JSON results file to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="The p50 slowdown that counts as a regression.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    engine = get_engine(args.engine).name
+    engine_options = json.loads(args.engine_options)
+    get_engine(engine).check_options(engine_options)
+    results: Dict[str, Any] = {
+        "environment": environment(),
+        "engine": engine,
+        "engine_options": engine_options,
+        "repeat": args.repeat,
+        "queries": args.queries,
+        "datasets": {},
+    }
+    for name in args.datasets:
+        result = benchmark_dataset(name, args.path, engine, engine_options, args.repeat, args.queries)
+        if result is None:
+            continue
+        results["datasets"][name] = result
+        logger.info(f"{'stage':<18} {'calls':>6} {'p50 ms':>10} {'p95 ms':>10} {'throughput':>22} {'peak MiB':>9}")
+        for stage, summary in result["stages"].items():
+            throughput = f"{summary['throughput']:,.0f} {summary['unit']}" if summary["throughput"] else "-"
+            logger.info(
+                f"{stage:<18} {summary['calls']:>6} {summary['p50_ms']:>10.3f} {summary['p95_ms']:>10.3f}"
+                f" {throughput:>22} {summary['peak_rss_mb'] or '-':>9}"
+            )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+        logger.info(f"Wrote the results to {args.output}")
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            logger.info(f"{len(regressions)} stages got more than {args.tolerance:.0%} slower: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class TTLCache:
+    """
+    A size-bounded LRU cache whose entries also expire after `ttl` seconds.
+
+    Entries carry wall clock expiry times so the cache can be written to disk and picked up again
+    after a restart.
+    """
+
+    def __init__(self, *, max_size: int = 4096, ttl: float = 86400.0) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < time.time():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key: str, value: Any) -> None:
+        self._entries[key] = (value, time.time() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def save(self, path: str) -> None:
+        """
+        Write the entries that haven't expired yet to a JSON file, least recently used first.
+
+        :param path: The file to write to, it is replaced atomically.
+        """
+        now = time.time()
+        entries = [[key, value, expires] for key, (value, expires) in self._entries.items() if expires >= now]
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(entries, file)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> None:
+        """
+        Add the entries saved by `save`, a missing or unreadable file is ignored.
+
+        :param path: The file to read from.
+        """
+        try:
+            with open(path) as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for key, value, expires in entries:
+            if expires >= now:
+                self._entries[key] = (value, min(expires, now + self.ttl))
+                self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
@@ -0,0 +1,46 @@
+"""
+Convert a MovieLens ratings file into the memory-mapped store the bot reads its ratings from.
+
+Parsing ml-25m takes a while, running this once ahead of time means the bot maps the finished
+store on startup instead of importing the text file::
+
+    python -m recommender.convert ml-25m --path data/ml-25m --output ratings
+
+With `--reindex` an existing store is rewritten instead, which moves the ratings added through
+the bot since it was built into the indexed part.
+"""
+
+import argparse
+import logging
+import time
+
+from .datasets import DATASETS, get_dataset
+from .store import MappedRatingStore
+
+logger = logging.getLogger("discord_bot.recommender")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("dataset", nargs="?", choices=sorted(DATASETS), help="The MovieLens release to convert.")
+    parser.add_argument("--path", help="The folder of the release, defaults to its name.")
+    parser.add_argument("--output", default="ratings", help="The folder of the store.")
+    parser.add_argument("--chunk-size", type=int, default=1_000_000, help="How many ratings to parse at a time.")
+    parser.add_argument("--reindex", action="store_true", help="Reindex the existing store instead.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    start = time.perf_counter()
+    if args.reindex:
+        store = MappedRatingStore.open(args.output)
+        store.reindex()
+    elif args.dataset is None:
+        parser.error("a dataset is required unless --reindex is given")
+    else:
+        dataset = get_dataset(args.dataset, args.path)
+        store = MappedRatingStore.build(args.output, dataset.iter_ratings(args.chunk_size))
+    logger.info(f"{args.output}: {store.describe()}, done in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+import os
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .store import RatingStore
+
+RatingChunk = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+class MovieLensDataset:
+    """
+    Describes where a MovieLens release keeps its files and how to parse them.
+
+    Ratings are streamed in chunks straight into typed NumPy columns (int32 ids, float32 ratings,
+    int64 timestamps), so even ml-25m never has to be held as Python objects or as one big
+    DataFrame.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        path: Optional[str] = None,
+        ratings_file: str,
+        movies_file: str,
+        users_file: Optional[str],
+        sep: str,
+        encoding: str,
+        header: bool = False,
+        rating_scale: Tuple[float, float] = (1, 5),
+    ) -> None:
+        self.name = name
+        self.ratings_file = ratings_file
+        self.movies_file = movies_file
+        self.users_file = users_file
+        self.sep = sep
+        self.encoding = encoding
+        self.header = header
+        self.rating_scale = rating_scale
+        self.path = path or name
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(self.file(self.ratings_file))
+
+    def _read_csv(self, name: str, columns: int, **kwargs):
+        if self.sep == "::":
+            # Splitting on ':' keeps pandas on its fast C parser, the empty fields in between are skipped
+            return pd.read_csv(
+                self.file(name),
+                sep=":",
+                header=None,
+                usecols=list(range(0, 2 * columns, 2)),
+                encoding=self.encoding,
+                **kwargs,
+            )
+        return pd.read_csv(
+            self.file(name),
+            sep=self.sep,
+            header=0 if self.header else None,
+            usecols=list(range(columns)),
+            encoding=self.encoding,
+            **kwargs,
+        )
+
+    def iter_ratings(self, chunk_size: int = 1_000_000) -> Iterator[RatingChunk]:
+        """
+        Stream the ratings file.
+
+        :param chunk_size: How many ratings to parse at once.
+        :return: An iterator of `(users, items, ratings, timestamps)` column chunks.
+        """
+        reader = self._read_csv(
+            self.ratings_file,
+            4,
+            chunksize=chunk_size,
+            dtype=np.float64,
+        )
+        for chunk in reader:
+            values = chunk.to_numpy()
+            yield (
+                values[:, 0].astype(np.int32),
+                values[:, 1].astype(np.int32),
+                values[:, 2].astype(np.float32),
+                values[:, 3].astype(np.int64),
+            )
+
+    def load_ratings(self, chunk_size: int = 1_000_000) -> RatingStore:
+        """
+        Read every rating into a `RatingStore`, one chunk at a time.
+        """
+        store = RatingStore()
+        for users, items, ratings, _ in self.iter_ratings(chunk_size):
+            store.extend(users, items, ratings)
+        return store
+
+    def load_movies(self) -> Dict[int, str]:
+        """
+        Read the movie titles.
+
+        :return: The title of every movie, by movie id.
+        """
+        if self.sep == "::":
+            # Titles may contain ':' themselves, so only the first two separators are split on
+            movies = {}
+            with open(self.file(self.movies_file), encoding=self.encoding) as file:
+                for line in file:
+                    movie_id, title, _ = line.split("::", 2)
+                    movies[int(movie_id)] = title
+            return movies
+        sep = "," if self.header else "|"
+        movie_data = pd.read_csv(
+            self.file(self.movies_file),
+            sep=sep,
+            header=0 if self.header else None,
+            usecols=[0, 1],
+            names=["movie_id", "title"],
+            encoding=self.encoding,
+        )
+        return dict(zip(movie_data["movie_id"].tolist(), movie_data["title"].tolist()))
+
+    def read_users(self) -> List[Tuple[int, Optional[str], Optional[str]]]:
+        """
+        Read the users file, if the dataset has one.
+
+        Users appended to ml-100k's `u.user` by older versions of the bot have their Discord
+        username and ID in the last two columns.
+
+        :return: `(user_id, discord_user_id, discord_username)` tuples, the Discord fields are `None` for MovieLens users.
+        """
+        if self.users_file is None or not os.path.exists(self.file(self.users_file)):
+            return []
+        if self.sep == "::":
+            user_data = self._read_csv(self.users_file, 1, names=["user_id"])
+            return [(user_id, None, None) for user_id in user_data["user_id"].tolist()]
+
+        column_names = ["user_id", "age", "gender", "occupation", "discord_username", "discord_user_id"]
+        user_data = pd.read_csv(self.file(self.users_file), delimiter="|", names=column_names, dtype=str)
+        discord_columns = user_data[["discord_user_id", "discord_username"]].astype(object)
+        discord_columns = discord_columns.where(user_data["discord_user_id"].notna(), None)
+        return list(
+            zip(
+                user_data["user_id"].astype(int).tolist(),
+                discord_columns["discord_user_id"].tolist(),
+                discord_columns["discord_username"].tolist(),
+            )
+        )
+
+
+DATASETS = {
+    "ml-100k": dict(
+        ratings_file="u.data", movies_file="u.item", users_file="u.user", sep="\t", encoding="ISO-8859-1"
+    ),
+    "ml-1m": dict(
+        ratings_file="ratings.dat", movies_file="movies.dat", users_file="users.dat", sep="::", encoding="ISO-8859-1"
+    ),
+    "ml-10m": dict(
+        ratings_file="ratings.dat",
+        movies_file="movies.dat",
+        users_file=None,
+        sep="::",
+        encoding="utf-8",
+        rating_scale=(0.5, 5),
+    ),
+    "ml-25m": dict(
+        ratings_file="ratings.csv",
+        movies_file="movies.csv",
+        users_file=None,
+        sep=",",
+        encoding="utf-8",
+        header=True,
+        rating_scale=(0.5, 5),
+    ),
+}
+
+
+TITLE_WORDS = (
+    "Star Night Return Dark King Love City Last Dead Man Wars Story Blood Lost Secret House Girl Time Big "
+    "Little American Summer Black Red Island River Dream War Heart Game Street Ghost Shadow Sea Fire Money "
+    "Princess Wild Road Lady Brother Knight Moon Angel Killer Paradise Home Journey Crime Hunter Wind"
+).split()
+
+
+class SyntheticDataset:
+    """
+    A generated stand-in for a MovieLens release of any size, for benchmarks and evaluations.
+
+    Ratings come from a low rank model plus noise, with a long tail of item popularity and user
+    activity like the real releases. Everything is derived from the seed, so the same name always
+    gives the same data, and ratings are generated a chunk at a time like a file would be parsed.
+    """
+
+    def __init__(
+        self,
+        n_ratings: int,
+        *,
+        n_users: Optional[int] = None,
+        n_items: Optional[int] = None,
+        rating_scale: Tuple[float, float] = (1, 5),
+        seed: int = 0,
+    ) -> None:
+        self.name = f"synthetic-{n_ratings}"
+        self.n_ratings = n_ratings
+        # Roughly the proportions of the MovieLens releases
+        self.n_users = n_users or max(n_ratings // 150, 10)
+        self.n_items = n_items or max(int(12 * n_ratings**0.5), 10)
+        self.rating_scale = rating_scale
+        self.seed = seed
+        self.exists = True
+
+        rng = np.random.default_rng(seed)
+        self._user_factors = rng.normal(0, 1, (self.n_users, 4)).astype(np.float32)
+        self._item_factors = rng.normal(0, 1, (self.n_items, 4)).astype(np.float32)
+        self._item_bias = rng.normal(0, 0.5, self.n_items).astype(np.float32)
+        popularity = (rng.permutation(self.n_items) + 10.0) ** -0.9
+        self._item_p = popularity / popularity.sum()
+        activity = rng.lognormal(0, 1, self.n_users)
+        self._user_p = activity / activity.sum()
+
+    def iter_ratings(self, chunk_size: int = 1_000_000) -> Iterator[RatingChunk]:
+        """
+        Generate the ratings.
+
+        :param chunk_size: How many ratings to generate at once.
+        :return: An iterator of `(users, items, ratings, timestamps)` column chunks.
+        """
+        low, high = self.rating_scale
+        step = 0.5 if low % 1 else 1.0
+        for number, start in enumerate(range(0, self.n_ratings, chunk_size)):
+            rng = np.random.default_rng([self.seed, number])
+            size = min(chunk_size, self.n_ratings - start)
+            users = rng.choice(self.n_users, size, p=self._user_p)
+            items = rng.choice(self.n_items, size, p=self._item_p)
+            signal = np.einsum("ij,ij->i", self._user_factors[users], self._item_factors[items])
+            ratings = (low + high) / 2 + 0.4 * signal + self._item_bias[items] + rng.normal(0, 0.5, size)
+            ratings = np.clip(np.round(ratings / step) * step, low, high)
+            yield (
+                (users + 1).astype(np.int32),
+                (items + 1).astype(np.int32),
+                ratings.astype(np.float32),
+                rng.integers(9 * 10**8, 16 * 10**8, size).astype(np.int64),
+            )
+
+    def load_ratings(self, chunk_size: int = 1_000_000) -> RatingStore:
+        """
+        Generate every rating into a `RatingStore`.
+        """
+        store = RatingStore()
+        for users, items, ratings, _ in self.iter_ratings(chunk_size):
+            store.extend(users, items, ratings)
+        return store
+
+    def load_movies(self) -> Dict[int, str]:
+        """
+        Made up titles in the MovieLens style, e.g. `Dark River Story (1987)`.
+
+        :return: The title of every movie, by movie id.
+        """
+        rng = np.random.default_rng(self.seed)
+        lengths = rng.integers(1, 5, self.n_items)
+        years = rng.integers(1920, 2024, self.n_items)
+        words = rng.integers(0, len(TITLE_WORDS), (self.n_items, 4))
+        return {
+            item + 1: " ".join(TITLE_WORDS[word] for word in words[item, : lengths[item]]) + f" ({years[item]})"
+            for item in range(self.n_items)
+        }
+
+    def read_users(self) -> List[Tuple[int, Optional[str], Optional[str]]]:
+        """
+        Every user, as a registered Discord user with a made up ID and username.
+        """
+        return [(user, str(10**17 + user), f"user{user}") for user in range(1, self.n_users + 1)]
+
+
+def get_dataset(name: str, path: Optional[str] = None) -> Union[MovieLensDataset, SyntheticDataset]:
+    """
+    Look up a supported MovieLens release, or a synthetic dataset named `synthetic-<number of ratings>`.
+
+    :param name: One of `ml-100k`, `ml-1m`, `ml-10m`, `ml-25m` or e.g. `synthetic-1000000`.
+    :param path: The folder holding its files, defaults to a folder named after the dataset.
+    """
+    if name.startswith("synthetic-") and name[len("synthetic-") :].isdigit():
+        return SyntheticDataset(int(name[len("synthetic-") :]))
+    if name not in DATASETS:
+        raise ValueError(f"Unknown dataset '{name}', expected one of {', '.join(DATASETS)} or synthetic-<ratings>")
+    return MovieLensDataset(name, path=path, **DATASETS[name])
@@ -0,0 +1,218 @@
+import inspect
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Type
+
+import numpy as np
+
+# A user's ratings, as returned by `MappedRatingStore.user_ratings`: raw item ids and ratings
+History = Callable[[int], Tuple[np.ndarray, np.ndarray]]
+
+ENGINES: Dict[str, Type["Engine"]] = {}
+
+
+def register_engine(cls: Type["Engine"]) -> Type["Engine"]:
+    """
+    Make an engine selectable by its `name`, in `config.json` and when loading snapshots.
+    """
+    ENGINES[cls.name] = cls
+    return cls
+
+
+def get_engine(name: str) -> Type["Engine"]:
+    """
+    Look up a recommender engine by name.
+
+    :param name: The name of the engine, e.g. `svd`, `als` or `item_knn`.
+    """
+    try:
+        return ENGINES[name]
+    except KeyError:
+        raise ValueError(f"Unknown recommender engine '{name}', expected one of {', '.join(sorted(ENGINES))}") from None
+
+
+class Engine:
+    """
+    What the `recommend` cog needs from a trained recommender.
+
+    Users and items are addressed by their raw (MovieLens) ids, `user_index` and `item_index` map
+    them to the inner ids the arrays are indexed by. Engines only hold their parameters, a user's
+    ratings are looked up through `history`, which the cog binds to its rating store before it
+    serves the model.
+
+    A fitted engine is saved as the arrays named in `ARRAYS` plus the scalars returned by `params`,
+    `from_arrays` rebuilds it from those.
+    """
+
+    name = ""
+    ARRAYS: Tuple[str, ...] = ()
+    OPTIONAL_ARRAYS: Tuple[str, ...] = ()
+
+    item_ids: np.ndarray
+    user_index: Dict[int, int]
+    item_index: Dict[int, int]
+    rating_scale: Tuple[float, float]
+    history: Optional[History] = None
+
+    @classmethod
+    def fit(
+        cls,
+        users: np.ndarray,
+        items: np.ndarray,
+        ratings: np.ndarray,
+        *,
+        rating_scale: Tuple[float, float] = (1, 5),
+        n_neighbors: int = 20,
+        **options: Any,
+    ) -> "Engine":
+        """
+        Fit a brand new model on all the ratings.
+
+        :param users: The raw user id of every rating.
+        :param items: The raw item id of every rating.
+        :param ratings: The ratings.
+        :param rating_scale: The lowest and highest possible rating.
+        :param n_neighbors: How many similar items to precompute per item.
+        :param options: Engine specific settings, from `engine_options` in `config.json`.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def _options_signature(cls, options: Dict[str, Any]) -> inspect.Signature:
+        # Whatever takes the engine options in the end, `fit` itself unless it passes them on
+        return inspect.signature(cls.fit)
+
+    @classmethod
+    def check_options(cls, options: Dict[str, Any]) -> None:
+        """
+        Reject engine options that `fit` would not take, so a typo fails when the settings are read
+        rather than in the training thread.
+
+        :param options: Engine specific settings, from `engine_options` in `config.json`.
+        """
+        accepted: Set[str] = {
+            name
+            for name, parameter in cls._options_signature(options).parameters.items()
+            if parameter.kind in (parameter.POSITIONAL_OR_KEYWORD, parameter.KEYWORD_ONLY)
+        } - {"users", "items", "ratings", "rating_scale", "n_neighbors"}
+        unknown = sorted(set(options) - accepted)
+        if unknown:
+            raise ValueError(
+                f"Unknown {cls.name} engine options {', '.join(unknown)}, expected some of {', '.join(sorted(accepted))}"
+            )
+
+    def partial_fit(self, ratings: Iterable[Tuple[int, int, float]]) -> None:
+        """
+        Fold new ratings into the model without a full refit, `history` must already include them.
+
+        :param ratings: `(user_id, item_id, rating)` tuples with raw ids.
+        """
+        raise NotImplementedError
+
+    def predict(self, user_id: int, item_id: int) -> float:
+        """
+        Estimate the rating a user would give to an item.
+
+        :param user_id: The raw id of the user.
+        :param item_id: The raw id of the item.
+        :return: The estimated rating, clipped to the rating scale.
+        """
+        raise NotImplementedError
+
+    def score_all(self, user_id: int) -> np.ndarray:
+        """
+        Score every item for a user at once, higher is better.
+
+        :param user_id: The raw id of the user.
+        :return: The unclipped scores, indexed by inner item id.
+        """
+        raise NotImplementedError
+
+    def similar_items(self, item_id: int, n: int = 10) -> List[Tuple[int, float]]:
+        """
+        The items closest to the given one.
+
+        :param item_id: The raw id of the item.
+        :param n: How many items to return.
+        :return: `(item_id, similarity)` tuples, most similar first.
+        """
+        raise NotImplementedError
+
+    def knows_user(self, user_id: int) -> bool:
+        return int(user_id) in self.user_index
+
+    def knows_item(self, item_id: int) -> bool:
+        return int(item_id) in self.item_index
+
+    def clip(self, estimate: float) -> float:
+        low, high = self.rating_scale
+        return float(min(high, max(low, estimate)))
+
+    def inner_items(self, item_ids: Iterable[int]) -> np.ndarray:
+        """
+        Map raw item ids to inner ids, items the model does not know are left out.
+        """
+        inner = (self.item_index.get(item_id) for item_id in np.asarray(item_ids).tolist())
+        return np.fromiter((i for i in inner if i is not None), dtype=np.int64)
+
+    def top_n(self, user_id: int, n: int = 10) -> List[Tuple[int, float]]:
+        """
+        The items the user is predicted to like the most among the ones they have not rated yet.
+
+        :param user_id: The raw id of the user.
+        :param n: How many items to return.
+        :return: `(item_id, estimate)` tuples, best first.
+        """
+        scores = np.array(self.score_all(user_id), dtype=np.float64)
+        if self.history is not None:
+            rated, _ = self.history(int(user_id))
+            scores[self.inner_items(rated)] = -np.inf
+        n = min(n, int(np.isfinite(scores).sum()))
+        if n <= 0:
+            return []
+        # Partial sort: only the n best candidates get fully ordered
+        best = np.argpartition(-scores, n - 1)[:n]
+        best = best[np.argsort(-scores[best])]
+        return [(int(self.item_ids[i]), self.clip(scores[i])) for i in best]
+
+    def _append_row(self, name: str, row: Any) -> None:
+        """
+        Append a row to one of the model's arrays, for the users and items `partial_fit` adds.
+
+        The array is a view over a larger buffer, which doubles like the `RatingStore` columns when
+        it runs out of room, so adding rows one by one doesn't copy the whole array every time.
+
+        :param name: The attribute holding the array.
+        :param row: The new row.
+        """
+        array = getattr(self, name)
+        n = len(array)
+        buffers = self.__dict__.setdefault("_buffers", {})
+        buffer = buffers.get(name)
+        # The array may have been replaced since it was last grown, e.g. by `build_similarity_index`
+        if buffer is None or array.base is not buffer or n == len(buffer):
+            buffer = np.empty((max(2 * n, 16),) + array.shape[1:], dtype=array.dtype)
+            buffer[:n] = array
+            buffers[name] = buffer
+        buffer[n] = row
+        setattr(self, name, buffer[: n + 1])
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """
+        The model's arrays, as written to snapshots.
+        """
+        arrays = {key: getattr(self, key) for key in self.ARRAYS}
+        for key in self.OPTIONAL_ARRAYS:
+            if getattr(self, key, None) is not None:
+                arrays[key] = getattr(self, key)
+        return arrays
+
+    def params(self) -> Dict[str, Any]:
+        """
+        The scalar settings of the model, together with `to_arrays` they rebuild it completely.
+        """
+        return {"rating_scale": list(self.rating_scale)}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], **params: Any) -> "Engine":
+        params["rating_scale"] = tuple(params["rating_scale"])
+        optional = {key: arrays[key] for key in cls.OPTIONAL_ARRAYS if key in arrays}
+        return cls(**{key: arrays[key] for key in cls.ARRAYS}, **optional, **params)
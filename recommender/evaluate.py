@@ -0,0 +1,332 @@
+"""
+Accuracy against training cost of the recommender engines, with k-fold cross-validation.
+
+Every configuration of a grid of engine settings is trained on each fold and scored on the
+ratings held out of it: RMSE and MAE of the predicted ratings, and precision@k and NDCG@k of the
+top picks, a held out rating of at least `--relevant` counting as a hit. The fits run in parallel
+on worker processes and every one is timed, so the report can point at the cheapest configuration
+that still meets a quality bar::
+
+    python -m recommender.evaluate ml-100k --grid n_factors=20,50,100 --grid n_epochs=10,20 --max-rmse 0.95
+
+The engine, its options and the dataset default to the `recommender` section of `config.json`.
+"""
+
+import argparse
+import inspect
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .benchmark import environment
+from .datasets import get_dataset
+from .engines import get_engine
+
+logger = logging.getLogger("discord_bot.recommender")
+
+# What is swept when no --grid is given
+DEFAULT_GRIDS: Dict[str, Dict[str, List[Any]]] = {
+    "svd": {"n_factors": [20, 50, 100], "n_epochs": [10, 20]},
+    "als": {"n_factors": [20, 50, 100], "n_epochs": [5, 15]},
+    "item_knn": {"k": [20, 40, 80], "shrinkage": [10, 100]},
+}
+
+# The ratings and the folds of the current evaluation, inherited by the forked workers
+_data: Dict[str, Any] = {}
+
+
+class TrainHistory:
+    """
+    The training ratings of every user, what `Engine.history` would return if only they existed.
+    """
+
+    def __init__(self, users: np.ndarray, items: np.ndarray, ratings: np.ndarray) -> None:
+        order = np.argsort(users, kind="stable")
+        self.users = users[order]
+        self.items = items[order]
+        self.ratings = ratings[order]
+
+    def __call__(self, user_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = np.searchsorted(self.users, [user_id, user_id + 1])
+        return self.items[start:end], self.ratings[start:end]
+
+
+def ranking_metrics(
+    model: Any,
+    users: np.ndarray,
+    items: np.ndarray,
+    ratings: np.ndarray,
+    k: int,
+    relevant: float,
+    max_users: Optional[int],
+    seed: int,
+) -> Tuple[float, float]:
+    """
+    Precision@k and NDCG@k of `model.top_n`, against the held out ratings of each user.
+
+    Only users with at least one relevant held out rating are counted.
+
+    :param users: The user of every held out rating.
+    :param items: The item of every held out rating.
+    :param ratings: The held out ratings.
+    :param k: How many top picks are scored.
+    :param relevant: The lowest rating that makes an item a hit.
+    :param max_users: Score a random sample of this many users, all of them if not given.
+    :return: The mean precision and NDCG.
+    """
+    hits = ratings >= relevant
+    candidates = np.unique(users[hits])
+    if max_users is not None and len(candidates) > max_users:
+        candidates = np.random.default_rng(seed).choice(candidates, max_users, replace=False)
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    precisions, ndcgs = [], []
+    for user_id in candidates.tolist():
+        liked = set(items[(users == user_id) & hits].tolist())
+        picked = np.array([item_id in liked for item_id, _ in model.top_n(user_id, k)], dtype=bool)
+        precisions.append(picked.sum() / k)
+        ideal = discounts[: min(len(liked), k)].sum()
+        ndcgs.append(discounts[: len(picked)][picked].sum() / ideal)
+    if not precisions:
+        return 0.0, 0.0
+    return float(np.mean(precisions)), float(np.mean(ndcgs))
+
+
+def _evaluate_fold(task: Tuple[int, Dict[str, Any], int]) -> Dict[str, Any]:
+    index, options, fold = task
+    users, items, ratings, folds = _data["users"], _data["items"], _data["ratings"], _data["folds"]
+    train, test = folds != fold, folds == fold
+
+    start = time.perf_counter()
+    model = get_engine(_data["engine"]).fit(
+        users[train],
+        items[train],
+        ratings[train],
+        rating_scale=_data["rating_scale"],
+        n_neighbors=_data["n_neighbors"],
+        **options,
+    )
+    fit_seconds = time.perf_counter() - start
+    model.history = TrainHistory(users[train], items[train], ratings[train])
+
+    start = time.perf_counter()
+    estimates = np.array([model.predict(u, i) for u, i in zip(users[test].tolist(), items[test].tolist())])
+    errors = ratings[test] - estimates
+    precision, ndcg = ranking_metrics(
+        model, users[test], items[test], ratings[test], _data["k"], _data["relevant"], _data["rank_users"], fold
+    )
+    return {
+        "config": index,
+        "fold": fold,
+        "fit_seconds": fit_seconds,
+        "eval_seconds": time.perf_counter() - start,
+        "rmse": float(np.sqrt(np.mean(errors**2))),
+        "mae": float(np.mean(np.abs(errors))),
+        "precision": precision,
+        "ndcg": ndcg,
+    }
+
+
+def evaluate(
+    users: np.ndarray,
+    items: np.ndarray,
+    ratings: np.ndarray,
+    *,
+    engine: str,
+    configs: Sequence[Dict[str, Any]],
+    rating_scale: Tuple[float, float] = (1, 5),
+    n_neighbors: int = 20,
+    folds: int = 5,
+    k: int = 10,
+    relevant: float = 4.0,
+    rank_users: Optional[int] = 1000,
+    processes: Optional[int] = None,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    """
+    Cross-validate every configuration of an engine.
+
+    Every `(configuration, fold)` pair is one task for the worker processes, so the sweep keeps
+    every core busy. When it runs on more than one process, engines that parallelize their own
+    training are told to use a single worker, so fits don't fight over the cores and their timings
+    stay comparable.
+
+    :param users: The raw user id of every rating.
+    :param items: The raw item id of every rating.
+    :param ratings: The ratings.
+    :param engine: The name of the engine to evaluate.
+    :param configs: The engine options of every configuration.
+    :param folds: How many folds the ratings are split into.
+    :param k: How many top picks the ranking metrics look at.
+    :param relevant: The lowest held out rating that counts as a hit.
+    :param rank_users: How many users per fold the ranking metrics are computed for, all if `None`.
+    :param processes: How many configurations are fitted at once, every core by default.
+    :return: The options and the mean and standard deviation of every metric, per configuration.
+    """
+    processes = min(processes or os.cpu_count() or 1, len(configs) * folds)
+    # Forking is safe here, unlike in the bot this command has no other threads running
+    if processes > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        logger.warning("Parallel evaluation needs the fork start method, evaluating on a single process")
+        processes = 1
+    if processes > 1:
+        own_workers = "workers" in inspect.signature(get_engine(engine).fit).parameters
+        configs = [{**options, "workers": 1} if own_workers or "workers" in options else options for options in configs]
+
+    _data.update(
+        users=np.asarray(users),
+        items=np.asarray(items),
+        ratings=np.asarray(ratings, dtype=np.float64),
+        folds=np.random.default_rng(seed).permutation(len(ratings)) % folds,
+        engine=engine,
+        rating_scale=rating_scale,
+        n_neighbors=n_neighbors,
+        k=k,
+        relevant=relevant,
+        rank_users=rank_users,
+    )
+    tasks = [(index, options, fold) for index, options in enumerate(configs) for fold in range(folds)]
+    try:
+        if processes == 1:
+            scores = [_evaluate_fold(task) for task in tasks]
+        else:
+            with multiprocessing.get_context("fork").Pool(processes) as pool:
+                scores = pool.map(_evaluate_fold, tasks, chunksize=1)
+    finally:
+        _data.clear()
+
+    results = []
+    for index, options in enumerate(configs):
+        config_scores = [score for score in scores if score["config"] == index]
+        summary: Dict[str, Any] = {"options": options}
+        for metric in ("fit_seconds", "eval_seconds", "rmse", "mae", "precision", "ndcg"):
+            values = np.array([score[metric] for score in config_scores])
+            summary[metric] = float(values.mean())
+            summary[f"{metric}_std"] = float(values.std())
+        results.append(summary)
+    return results
+
+
+def parse_grid(specs: Sequence[str]) -> Dict[str, List[Any]]:
+    """
+    Parse `name=value,value,...` settings, values are read as JSON when they can be, e.g. `implicit=true`.
+    """
+    grid = {}
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        if not values:
+            raise ValueError(f"Expected name=value,value,... but got '{spec}'")
+        grid[name.strip()] = [_parse_value(value.strip()) for value in values.split(",")]
+    return grid
+
+
+def _parse_value(value: str) -> Any:
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def pick_cheapest(
+    results: Sequence[Dict[str, Any]], max_rmse: Optional[float] = None, min_ndcg: Optional[float] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    The configuration that trains the fastest among the ones meeting the quality bar.
+    """
+    passing = [
+        result
+        for result in results
+        if (max_rmse is None or result["rmse"] <= max_rmse) and (min_ndcg is None or result["ndcg"] >= min_ndcg)
+    ]
+    return min(passing, key=lambda result: result["fit_seconds"], default=None)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cross-validate recommender engine settings against their training time.")
+    parser.add_argument("dataset", nargs="?", help="A MovieLens release or synthetic-<ratings>, defaults to config.json.")
+    parser.add_argument("--path", help="The folder of the MovieLens release.")
+    parser.add_argument("--config", default="config.json", help="Where the engine and dataset defaults are read from.")
+    parser.add_argument("--engine", help="The engine to evaluate, defaults to config.json.")
+    parser.add_argument("--engine-options", help="Options shared by every configuration, as JSON.")
+    parser.add_argument(
+        "--grid", action="append", default=[], help="Sweep a setting, e.g. --grid n_factors=20,50,100, repeatable."
+    )
+    parser.add_argument("--folds", type=int, default=5, help="How many folds to cross-validate on.")
+    parser.add_argument("--k", type=int, default=10, help="How many top picks precision and NDCG look at.")
+    parser.add_argument("--relevant", type=float, default=4.0, help="The lowest held out rating that counts as a hit.")
+    parser.add_argument("--rank-users", type=int, default=1000, help="Users per fold scored for ranking, 0 for all.")
+    parser.add_argument("--processes", type=int, help="How many fits run at once, every core by default.")
+    parser.add_argument("--max-rmse", type=float, help="The quality bar: the highest acceptable RMSE.")
+    parser.add_argument("--min-ndcg", type=float, help="The quality bar: the lowest acceptable NDCG@k.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    settings: Dict[str, Any] = {}
+    if os.path.isfile(args.config):
+        with open(args.config) as file:
+            settings = json.load(file).get("recommender", {})
+    engine = get_engine(args.engine or settings.get("engine", "svd")).name
+    base_options = json.loads(args.engine_options) if args.engine_options else settings.get("engine_options", {})
+    grid = parse_grid(args.grid) if args.grid else DEFAULT_GRIDS.get(engine, {})
+    configs = [{**base_options, **dict(zip(grid, values))} for values in itertools.product(*grid.values())]
+    for options in configs:
+        get_engine(engine).check_options(options)
+
+    dataset = get_dataset(args.dataset or settings.get("dataset", "ml-100k"), args.path or settings.get("dataset_path"))
+    users, items, ratings = dataset.load_ratings().columns()
+    logger.info(
+        f"{dataset.name}: {len(ratings):,} ratings, {engine} engine, {len(configs)} configurations x {args.folds} folds"
+    )
+    results = evaluate(
+        users,
+        items,
+        ratings,
+        engine=engine,
+        configs=configs,
+        rating_scale=dataset.rating_scale,
+        n_neighbors=settings.get("similar_neighbors", 20),
+        folds=args.folds,
+        k=args.k,
+        relevant=args.relevant,
+        rank_users=args.rank_users or None,
+        processes=args.processes,
+    )
+
+    has_bar = args.max_rmse is not None or args.min_ndcg is not None
+    best = pick_cheapest(results, args.max_rmse, args.min_ndcg) if has_bar else None
+    logger.info(
+        f"{'options':<40} {'fit s':>8} {'rmse':>15} {'mae':>7} {f'prec@{args.k}':>8} {f'ndcg@{args.k}':>8}"
+    )
+    for result in sorted(results, key=lambda result: result["fit_seconds"]):
+        options = ", ".join(f"{key}={value}" for key, value in result["options"].items())
+        logger.info(
+            f"{options:<40} {result['fit_seconds']:>8.2f} {result['rmse']:>8.4f} ±{result['rmse_std']:.4f}"
+            f" {result['mae']:>7.4f} {result['precision']:>8.4f} {result['ndcg']:>8.4f}"
+            f"{'  <- cheapest meeting the bar' if result is best else ''}"
+        )
+    if has_bar and best is None:
+        logger.info("No configuration meets the quality bar")
+
+    if args.output:
+        report = {
+            "environment": environment(),
+            "dataset": dataset.name,
+            "engine": engine,
+            "folds": args.folds,
+            "k": args.k,
+            "relevant": args.relevant,
+            "results": results,
+            "cheapest": best,
+        }
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+        logger.info(f"Wrote the results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
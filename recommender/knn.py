@@ -0,0 +1,273 @@
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from .engines import Engine, register_engine
+
+
+def fit_baselines(
+    users: np.ndarray, items: np.ndarray, ratings: np.ndarray, reg_user: float, reg_item: float, n_iter: int
+) -> Tuple[float, np.ndarray, np.ndarray]:
+    """
+    Fit `mean + bu[u] + bi[i]` by alternating regularized means, like Surprise's ALS baselines.
+
+    :param users: The inner user id of every rating.
+    :param items: The inner item id of every rating.
+    :param ratings: The ratings.
+    :return: The global mean and the user and item biases.
+    """
+    mean = float(ratings.mean())
+    n_users, n_items = int(users.max()) + 1, int(items.max()) + 1
+    user_counts = np.bincount(users, minlength=n_users)
+    item_counts = np.bincount(items, minlength=n_items)
+    bu = np.zeros(n_users)
+    bi = np.zeros(n_items)
+    for _ in range(n_iter):
+        bi = np.bincount(items, ratings - mean - bu[users], n_items) / (reg_item + item_counts)
+        bu = np.bincount(users, ratings - mean - bi[items], n_users) / (reg_user + user_counts)
+    return mean, bu, bi
+
+
+@register_engine
+class ItemKNNModel(Engine):
+    """
+    The `item_knn` engine, a neighborhood baseline: `r(u, i) = b(u, i) + weighted mean of the
+    residuals of u's ratings on the k items most similar to i`, with `b(u, i) = mean + bu[u] + bi[i]`.
+
+    Item similarities are the cosine of the items' rating residuals, shrunk towards 0 when two items
+    have few raters in common. They are computed a block of items at a time with sparse products and
+    only the top `max(k, n_neighbors)` of every item are kept, predictions use the first `k` and
+    `similar_items` all of them. The only per-user parameter is the bias, so updates are
+    cheap, but every prediction needs the user's ratings through `history`.
+    """
+
+    name = "item_knn"
+    ARRAYS = ("bu", "bi", "user_ids", "item_ids", "neighbors", "neighbor_scores")
+
+    def __init__(
+        self,
+        *,
+        bu: np.ndarray,
+        bi: np.ndarray,
+        global_mean: float,
+        user_ids: np.ndarray,
+        item_ids: np.ndarray,
+        neighbors: np.ndarray,
+        neighbor_scores: np.ndarray,
+        rating_scale: Tuple[float, float] = (1, 5),
+        reg_user: float = 15.0,
+        reg_item: float = 10.0,
+        k: int = 40,
+    ) -> None:
+        self.bu = bu
+        self.bi = bi
+        self.global_mean = global_mean
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+        self.neighbors = neighbors
+        self.neighbor_scores = neighbor_scores
+        self.rating_scale = rating_scale
+        self.reg_user = reg_user
+        self.reg_item = reg_item
+        self.k = k
+
+        self.user_index: Dict[int, int] = {int(raw): inner for inner, raw in enumerate(user_ids)}
+        self.item_index: Dict[int, int] = {int(raw): inner for inner, raw in enumerate(item_ids)}
+
+    @classmethod
+    def fit(
+        cls,
+        users: np.ndarray,
+        items: np.ndarray,
+        ratings: np.ndarray,
+        *,
+        rating_scale: Tuple[float, float] = (1, 5),
+        n_neighbors: int = 20,
+        k: int = 40,
+        shrinkage: float = 100.0,
+        reg_user: float = 15.0,
+        reg_item: float = 10.0,
+        n_iter: int = 10,
+        block_elements: int = 1 << 24,
+    ) -> "ItemKNNModel":
+        """
+        Fit the baselines, then keep the `max(k, n_neighbors)` most similar items of every item.
+
+        :param k: How many neighbors a prediction is made from.
+        :param shrinkage: How many common raters it takes for a similarity to count half.
+        :param block_elements: Upper bound on the size of one block of the dense similarity matrix.
+        """
+        user_ids, inner_users = np.unique(users, return_inverse=True)
+        item_ids, inner_items = np.unique(items, return_inverse=True)
+        values = np.asarray(ratings, dtype=np.float64)
+        mean, bu, bi = fit_baselines(inner_users, inner_items, values, reg_user, reg_item, n_iter)
+
+        n_users, n_items = len(user_ids), len(item_ids)
+        residuals = values - mean - bu[inner_users] - bi[inner_items]
+        by_item = sparse.csr_matrix((residuals, (inner_items, inner_users)), shape=(n_items, n_users))
+        rated = sparse.csr_matrix((np.ones(len(values)), (inner_items, inner_users)), shape=(n_items, n_users))
+        norms = np.sqrt(np.asarray(by_item.multiply(by_item).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+
+        width = min(max(k, n_neighbors), n_items - 1)
+        neighbors = np.tile(np.arange(n_items, dtype=np.int32)[:, None], (1, max(width, 0)))
+        neighbor_scores = np.zeros((n_items, max(width, 0)), dtype=np.float32)
+        block_size = max(block_elements // max(n_items, 1), 1)
+        if width > 0:
+            for start in range(0, n_items, block_size):
+                end = min(start + block_size, n_items)
+                dots = (by_item[start:end] @ by_item.T).toarray()
+                common = (rated[start:end] @ rated.T).toarray()
+                shrunk = common / np.maximum(common + shrinkage, 1e-12)
+                sims = dots / (norms[start:end, None] * norms[None, :]) * shrunk
+                rows = np.arange(end - start)
+                sims[rows, rows + start] = -np.inf
+                best = np.argpartition(-sims, width - 1, axis=1)[:, :width]
+                best_sims = np.take_along_axis(sims, best, axis=1)
+                order = np.argsort(-best_sims, axis=1)
+                neighbors[start:end] = np.take_along_axis(best, order, axis=1)
+                neighbor_scores[start:end] = np.take_along_axis(best_sims, order, axis=1)
+
+        return cls(
+            bu=bu,
+            bi=bi,
+            global_mean=mean,
+            user_ids=user_ids.astype(np.int64),
+            item_ids=item_ids.astype(np.int64),
+            neighbors=neighbors,
+            neighbor_scores=neighbor_scores,
+            rating_scale=rating_scale,
+            reg_user=reg_user,
+            reg_item=reg_item,
+            k=k,
+        )
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        arrays = super().to_arrays()
+        for key in ("bu", "bi"):
+            arrays[key] = arrays[key].astype(np.float32)
+        return arrays
+
+    def params(self) -> Dict[str, Any]:
+        return {
+            **super().params(),
+            "global_mean": float(self.global_mean),
+            "reg_user": self.reg_user,
+            "reg_item": self.reg_item,
+            "k": self.k,
+        }
+
+    def _baselines(self, user_id: int) -> np.ndarray:
+        u = self.user_index.get(int(user_id))
+        return self.global_mean + self.bi + (self.bu[u] if u is not None else 0.0)
+
+    def _residuals(self, user_id: int, baselines: np.ndarray) -> np.ndarray:
+        # The user's residual on every item, NaN for the items they haven't rated
+        residuals = np.full(len(self.item_ids), np.nan)
+        if self.history is not None:
+            item_ids, ratings = self.history(int(user_id))
+            rated = np.array([self.item_index.get(i, -1) for i in np.asarray(item_ids).tolist()], dtype=np.int64)
+            known = rated >= 0
+            residuals[rated[known]] = np.asarray(ratings)[known] - baselines[rated[known]]
+        return residuals
+
+    def _neighborhood(self, residuals: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        # Weighted mean of the residuals over the rated neighbors with a positive similarity
+        neighbor_residuals = residuals[self.neighbors[rows, : self.k]]
+        weights = np.where(np.isnan(neighbor_residuals), 0.0, np.maximum(self.neighbor_scores[rows, : self.k], 0.0))
+        numerator = (weights * np.nan_to_num(neighbor_residuals)).sum(axis=1)
+        denominator = weights.sum(axis=1)
+        return np.divide(numerator, denominator, out=np.zeros(len(rows)), where=denominator > 0)
+
+    def predict(self, user_id: int, item_id: int) -> float:
+        """
+        Estimate the rating a user would give to an item, the baseline alone if none of its neighbors were rated.
+
+        :param user_id: The raw id of the user.
+        :param item_id: The raw id of the item.
+        :return: The estimated rating, clipped to the rating scale.
+        """
+        i = self.item_index.get(int(item_id))
+        u = self.user_index.get(int(user_id))
+        if i is None:
+            return self.clip(self.global_mean + (self.bu[u] if u is not None else 0.0))
+        baselines = self._baselines(user_id)
+        residuals = self._residuals(user_id, baselines)
+        return self.clip(baselines[i] + self._neighborhood(residuals, np.array([i]))[0])
+
+    def score_all(self, user_id: int) -> np.ndarray:
+        """
+        Estimate the user's rating for every item at once, from one residual vector of the user.
+
+        :param user_id: The raw id of the user.
+        :return: The unclipped estimates, indexed by inner item id.
+        """
+        baselines = self._baselines(user_id)
+        residuals = self._residuals(user_id, baselines)
+        return baselines + self._neighborhood(residuals, np.arange(len(self.item_ids)))
+
+    def similar_items(self, item_id: int, n: int = 10) -> List[Tuple[int, float]]:
+        """
+        The items whose ratings vary the most like the given one's.
+
+        :param item_id: The raw id of the item.
+        :param n: How many items to return.
+        :return: `(item_id, similarity)` tuples, most similar first.
+        """
+        i = self.item_index.get(int(item_id))
+        if i is None:
+            return []
+        return [
+            (int(self.item_ids[j]), float(sim))
+            for j, sim in zip(self.neighbors[i, :n].tolist(), self.neighbor_scores[i, :n].tolist())
+            if j != i
+        ]
+
+    def partial_fit(self, ratings: Iterable[Tuple[int, int, float]]) -> None:
+        """
+        Fold new ratings into the model without a full refit.
+
+        The bias of every affected user is estimated again from all of their ratings. Items the
+        model has never seen get a bias from these users' ratings and no neighbors until the next
+        full fit.
+
+        :param ratings: `(user_id, item_id, rating)` tuples with raw ids.
+        """
+        new_items: Dict[int, List[float]] = {}
+        for user_id in sorted({int(user_id) for user_id, _, _ in ratings}):
+            item_ids, ratings_u = self.history(user_id)
+            item_ids = np.asarray(item_ids).tolist()
+            ratings_u = np.asarray(ratings_u, dtype=np.float64)
+            for item_id in item_ids:
+                if item_id not in self.item_index:
+                    self._add_item(item_id)
+                    new_items[item_id] = []
+            rated = np.array([self.item_index[item_id] for item_id in item_ids], dtype=np.int64)
+            u = self.user_index.get(user_id)
+            if u is None:
+                u = self._add_user(user_id)
+            residuals = ratings_u - self.global_mean - self.bi[rated]
+            self.bu[u] = residuals.sum() / (self.reg_user + len(rated))
+            for item_id, rating in zip(item_ids, ratings_u.tolist()):
+                if item_id in new_items:
+                    new_items[item_id].append(rating - self.global_mean - self.bu[u])
+        for item_id, residuals in new_items.items():
+            self.bi[self.item_index[item_id]] = sum(residuals) / (self.reg_item + len(residuals))
+
+    def _add_user(self, user_id: int) -> int:
+        u = len(self.user_ids)
+        self._append_row("user_ids", user_id)
+        self._append_row("bu", 0.0)
+        self.user_index[user_id] = u
+        return u
+
+    def _add_item(self, item_id: int) -> int:
+        i = len(self.item_ids)
+        self._append_row("item_ids", item_id)
+        self._append_row("bi", 0.0)
+        # A new item is its own only neighbor, with no weight, until the next full fit
+        self._append_row("neighbors", i)
+        self._append_row("neighbor_scores", 0.0)
+        self.item_index[item_id] = i
+        return i
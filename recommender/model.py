@@ -0,0 +1,398 @@
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from surprise import SVD
+
+from .engines import Engine, register_engine
+from .parallel import fit_sgd
+from .training import build_trainset
+
+
+# Upper bound on the floats of the stacked normal equations solved at once, per thread
+BLOCK_ELEMENTS = 1 << 23
+
+
+def to_csr(rows: np.ndarray, cols: np.ndarray, values: np.ndarray, n_rows: int) -> Tuple[np.ndarray, ...]:
+    """
+    Group ratings by row, e.g. by user or by item.
+
+    :return: The `indptr`, column and value arrays of the CSR matrix.
+    """
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return indptr, cols[order], values[order]
+
+
+def solve_rows(
+    indptr: np.ndarray,
+    cols: np.ndarray,
+    values: np.ndarray,
+    other: np.ndarray,
+    other_bias: np.ndarray,
+    mean: float,
+    reg: float,
+    implicit: bool = False,
+    alpha: float = 40.0,
+    pool: Optional[ThreadPoolExecutor] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    One half-step of ALS: the least squares factors (and biases) of every row with the other side fixed.
+
+    The `k x k` system of every row is built with BLAS from the factors of the items it rated,
+    `x.T @ x`, which only ever touches `nnz * k` floats, rather than materializing a `k x k`
+    outer product per rating. Rows are cut into blocks of at most `BLOCK_ELEMENTS` floats of
+    systems, each solved with one stacked `np.linalg.solve` that runs outside the GIL, so blocks
+    on different threads overlap. Every row needs at least one rating.
+
+    :param indptr: The CSR offsets of the rows.
+    :param cols: The inner ids on the other side, per rating.
+    :param values: The ratings.
+    :param other: The factors of the other side.
+    :param other_bias: The biases of the other side, unused in implicit mode.
+    :param mean: The global mean rating, 0 in implicit mode.
+    :param reg: The regularization, scaled by the number of ratings of each row in explicit mode.
+    :param implicit: Treat ratings as confidences instead of targets.
+    :param alpha: How fast the confidence grows with the rating in implicit mode.
+    :param pool: The threads to solve the blocks on, in the calling thread if not given.
+    :return: The factors and the biases of the rows.
+    """
+    n_rows, k = len(indptr) - 1, other.shape[1]
+    d = k if implicit else k + 1
+    factors = np.empty((n_rows, k))
+    biases = np.zeros(n_rows)
+    if implicit:
+        gram = other.T @ other
+    else:
+        # The bias is solved for as one more factor, against a constant column
+        other = np.hstack([other, np.ones((len(other), 1))])
+
+    block_rows = max(BLOCK_ELEMENTS // (d * d), 1)
+    bounds = [(start, min(start + block_rows, n_rows)) for start in range(0, n_rows, block_rows)]
+
+    def solve_block(bound: Tuple[int, int]) -> None:
+        start, end = bound
+        a = np.empty((end - start, d, d))
+        b = np.empty((end - start, d))
+        for row in range(start, end):
+            lo, hi = indptr[row], indptr[row + 1]
+            x = other[cols[lo:hi]]
+            r = values[lo:hi]
+            if implicit:
+                # Confidence `1 + alpha * r`, the 1 is the Gram matrix shared by every row
+                a[row - start] = (x.T * (alpha * r)) @ x
+                b[row - start] = x.T @ (1 + alpha * r)
+            else:
+                a[row - start] = x.T @ x
+                b[row - start] = x.T @ (r - mean - other_bias[cols[lo:hi]])
+        if implicit:
+            a += gram + reg * np.eye(d)
+        else:
+            a += reg * np.diff(indptr[start : end + 1])[:, None, None] * np.eye(d)
+        solution = np.linalg.solve(a, b[:, :, None])[:, :, 0]
+        factors[start:end] = solution[:, :k]
+        if not implicit:
+            biases[start:end] = solution[:, k]
+
+    list((pool.map if pool is not None else map)(solve_block, bounds))
+    return factors, biases
+
+
+@register_engine
+class FactorModel(Engine):
+    """
+    A trained latent factor model: `r(u, i) = mean + bu[u] + bi[i] + qi[i] . pu[u]`.
+
+    This is the `svd` engine, fitted with Surprise's SVD and updated per user in closed form
+    between fits. Once `build_similarity_index` has run, the top neighbors of every item are
+    precomputed as well.
+    """
+
+    name = "svd"
+
+    def __init__(
+        self,
+        *,
+        pu: np.ndarray,
+        qi: np.ndarray,
+        bu: np.ndarray,
+        bi: np.ndarray,
+        global_mean: float,
+        user_ids: np.ndarray,
+        item_ids: np.ndarray,
+        rating_scale: Tuple[float, float] = (1, 5),
+        lr: float = 0.005,
+        reg: float = 0.02,
+        n_epochs: int = 20,
+        init_std: float = 0.1,
+        neighbors: Optional[np.ndarray] = None,
+        neighbor_scores: Optional[np.ndarray] = None,
+    ) -> None:
+        self.pu = pu
+        self.qi = qi
+        self.bu = bu
+        self.bi = bi
+        self.global_mean = global_mean
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+        self.rating_scale = rating_scale
+        self.lr = lr
+        self.reg = reg
+        self.n_epochs = n_epochs
+        self.init_std = init_std
+        self.neighbors = neighbors
+        self.neighbor_scores = neighbor_scores
+
+        self.user_index: Dict[int, int] = {int(raw): inner for inner, raw in enumerate(user_ids)}
+        self.item_index: Dict[int, int] = {int(raw): inner for inner, raw in enumerate(item_ids)}
+
+    @classmethod
+    def fit(
+        cls,
+        users: np.ndarray,
+        items: np.ndarray,
+        ratings: np.ndarray,
+        *,
+        rating_scale: Tuple[float, float] = (1, 5),
+        n_neighbors: int = 20,
+        **options: Any,
+    ) -> "FactorModel":
+        """
+        Fit Surprise's SVD, `options` are passed on to it (`n_factors`, `n_epochs`, `lr_all`, `reg_all`, ...).
+
+        With a `workers` option the same model is trained with stratified parallel SGD on that many
+        processes instead, see `recommender.parallel`, which only takes some of those settings.
+        """
+        if "workers" in options:
+            fitted = fit_sgd(users, items, ratings, **options)
+            model = cls(
+                **fitted,
+                rating_scale=rating_scale,
+                lr=options.get("lr_all", 0.005),
+                reg=options.get("reg_all", 0.02),
+                n_epochs=options.get("n_epochs", 20),
+                init_std=options.get("init_std_dev", 0.1),
+            )
+            model.build_similarity_index(n_neighbors)
+            return model
+
+        algo = SVD(**options)
+        algo.fit(build_trainset(users, items, ratings, rating_scale))
+        model = cls.from_svd(algo)
+        model.build_similarity_index(n_neighbors)
+        return model
+
+    @classmethod
+    def _options_signature(cls, options: Dict[str, Any]) -> inspect.Signature:
+        return inspect.signature(fit_sgd if "workers" in options else SVD)
+
+    @classmethod
+    def from_svd(cls, algo: SVD) -> "FactorModel":
+        """
+        Take over the parameters of a fitted Surprise SVD.
+
+        :param algo: The fitted model, its trainset must use numeric raw ids.
+        """
+        trainset = algo.trainset
+        user_ids = np.array([int(trainset.to_raw_uid(u)) for u in trainset.all_users()], dtype=np.int64)
+        item_ids = np.array([int(trainset.to_raw_iid(i)) for i in trainset.all_items()], dtype=np.int64)
+        return cls(
+            pu=np.array(algo.pu),
+            qi=np.array(algo.qi),
+            bu=np.array(algo.bu),
+            bi=np.array(algo.bi),
+            global_mean=trainset.global_mean,
+            user_ids=user_ids,
+            item_ids=item_ids,
+            rating_scale=trainset.rating_scale,
+            lr=algo.lr_bu,
+            reg=algo.reg_bu,
+            n_epochs=algo.n_epochs,
+            init_std=algo.init_std_dev,
+        )
+
+    # Arrays that make up the model, as written to snapshots
+    ARRAYS = ("pu", "qi", "bu", "bi", "user_ids", "item_ids")
+    OPTIONAL_ARRAYS = ("neighbors", "neighbor_scores")
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """
+        The model's arrays in a compact form, factors and biases are stored as float32.
+        """
+        arrays = super().to_arrays()
+        for key in ("pu", "qi", "bu", "bi"):
+            arrays[key] = arrays[key].astype(np.float32)
+        return arrays
+
+    def params(self) -> Dict[str, Any]:
+        """
+        The scalar settings of the model, together with `to_arrays` they rebuild it completely.
+        """
+        return {
+            **super().params(),
+            "global_mean": float(self.global_mean),
+            "lr": self.lr,
+            "reg": self.reg,
+            "n_epochs": self.n_epochs,
+            "init_std": self.init_std,
+        }
+
+    @property
+    def n_factors(self) -> int:
+        return self.pu.shape[1]
+
+    def predict(self, user_id: int, item_id: int) -> float:
+        """
+        Estimate the rating a user would give to an item, falling back to the biases that are known.
+
+        :param user_id: The raw id of the user.
+        :param item_id: The raw id of the item.
+        :return: The estimated rating, clipped to the rating scale.
+        """
+        u = self.user_index.get(int(user_id))
+        i = self.item_index.get(int(item_id))
+        est = self.global_mean
+        if u is not None:
+            est += self.bu[u]
+        if i is not None:
+            est += self.bi[i]
+        if u is not None and i is not None:
+            est += float(np.dot(self.qi[i], self.pu[u]))
+        return self.clip(est)
+
+    def score_all(self, user_id: int) -> np.ndarray:
+        """
+        Estimate the user's rating for every item at once, with one matrix-vector product.
+
+        :param user_id: The raw id of the user.
+        :return: The unclipped estimates, indexed by inner item id.
+        """
+        u = self.user_index.get(int(user_id))
+        if u is None:
+            return self.global_mean + self.bi
+        return self.global_mean + self.bu[u] + self.bi + self.qi @ self.pu[u]
+
+    def _normalized_item_factors(self) -> np.ndarray:
+        norms = np.linalg.norm(self.qi, axis=1, keepdims=True)
+        return (self.qi / np.maximum(norms, 1e-12)).astype(np.float32)
+
+    def build_similarity_index(self, k: int = 20, block_size: int = 1024) -> None:
+        """
+        Precompute the `k` most similar items of every item by cosine similarity of the item factors.
+
+        The similarity matrix is computed one block of rows at a time so memory stays at
+        `block_size * n_items` floats even for large catalogs.
+
+        :param k: How many neighbors to keep per item.
+        :param block_size: How many items to score per block.
+        """
+        normalized = self._normalized_item_factors()
+        n_items = len(normalized)
+        k = min(k, n_items - 1)
+        neighbors = np.empty((n_items, max(k, 0)), dtype=np.int32)
+        neighbor_scores = np.empty((n_items, max(k, 0)), dtype=np.float32)
+        if k > 0:
+            for start in range(0, n_items, block_size):
+                end = min(start + block_size, n_items)
+                sims = normalized[start:end] @ normalized.T
+                rows = np.arange(end - start)
+                sims[rows, rows + start] = -np.inf
+                best = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+                best_sims = np.take_along_axis(sims, best, axis=1)
+                order = np.argsort(-best_sims, axis=1)
+                neighbors[start:end] = np.take_along_axis(best, order, axis=1)
+                neighbor_scores[start:end] = np.take_along_axis(best_sims, order, axis=1)
+        self.neighbors = neighbors
+        self.neighbor_scores = neighbor_scores
+
+    def similar_items(self, item_id: int, n: int = 10) -> List[Tuple[int, float]]:
+        """
+        The items closest to the given one in the latent space.
+
+        Served from the precomputed index when possible, items that were only seen through
+        incremental updates are scored exactly against the whole catalog.
+
+        :param item_id: The raw id of the item.
+        :param n: How many items to return.
+        :return: `(item_id, cosine similarity)` tuples, most similar first.
+        """
+        i = self.item_index.get(int(item_id))
+        if i is None:
+            return []
+        if self.neighbors is not None and i < len(self.neighbors) and n <= self.neighbors.shape[1]:
+            best, sims = self.neighbors[i, :n], self.neighbor_scores[i, :n]
+        else:
+            normalized = self._normalized_item_factors()
+            scores = normalized @ normalized[i]
+            scores[i] = -np.inf
+            n = min(n, len(scores) - 1)
+            if n <= 0:
+                return []
+            best = np.argpartition(-scores, n - 1)[:n]
+            best = best[np.argsort(-scores[best])]
+            sims = scores[best]
+        return [(int(self.item_ids[j]), float(sim)) for j, sim in zip(best, sims)]
+
+    def _add_user(self, user_id: int) -> int:
+        u = len(self.user_ids)
+        self._append_row("user_ids", user_id)
+        self._append_row("pu", np.random.normal(0, self.init_std, self.n_factors))
+        self._append_row("bu", 0.0)
+        self.user_index[user_id] = u
+        return u
+
+    def _add_item(self, item_id: int) -> int:
+        i = len(self.item_ids)
+        self._append_row("item_ids", item_id)
+        self._append_row("qi", np.random.normal(0, self.init_std, self.n_factors))
+        self._append_row("bi", 0.0)
+        self.item_index[item_id] = i
+        return i
+
+    def partial_fit(self, ratings: Iterable[Tuple[int, int, float]]) -> None:
+        """
+        Fold new ratings into the model without a full refit.
+
+        Every affected user is solved again in closed form against the current item factors, over
+        all of their ratings, one ridge regression like an ALS half-step, see `solve_rows`. That
+        takes a few stacked BLAS calls however many ratings the user has. Items the model has never seen are then solved from the ratings of
+        those users, everything else stays as it was after the last full fit.
+
+        :param ratings: `(user_id, item_id, rating)` tuples with raw ids.
+        """
+        user_ids = sorted({int(user_id) for user_id, _, _ in ratings})
+        if not user_ids:
+            return
+        known_items = len(self.item_ids)
+        rows, cols, values = [], [], []
+        for user_id in user_ids:
+            if user_id not in self.user_index:
+                self._add_user(user_id)
+            item_ids, ratings_u = self.history(user_id)
+            for item_id, rating in zip(np.asarray(item_ids).tolist(), np.asarray(ratings_u).tolist()):
+                i = self.item_index.get(item_id)
+                if i is None:
+                    i = self._add_item(item_id)
+                rows.append(self.user_index[user_id])
+                cols.append(i)
+                values.append(rating)
+        rows, cols, values = np.array(rows), np.array(cols), np.array(values, dtype=np.float64)
+
+        if len(rows):
+            users, local_rows = np.unique(rows, return_inverse=True)
+            by_user = to_csr(local_rows, cols, values, len(users))
+            self.pu[users], self.bu[users] = self._solve(by_user, self.qi, self.bi)
+
+        new = cols >= known_items
+        if np.any(new):
+            items, local_items = np.unique(cols[new], return_inverse=True)
+            by_item = to_csr(local_items, rows[new], values[new], len(items))
+            self.qi[items], self.bi[items] = self._solve(by_item, self.pu, self.bu)
+
+    def _solve(
+        self, by_row: Tuple[np.ndarray, ...], other: np.ndarray, other_bias: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # The least squares factors and biases of the rows of `by_row`, as in `solve_rows`
+        return solve_rows(*by_row, other, other_bias, self.global_mean, self.reg)
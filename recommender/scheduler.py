@@ -0,0 +1,64 @@
+import asyncio
+from typing import Any, List, Optional
+
+from .training import TrainingWorker
+
+
+class RetrainScheduler:
+    """
+    Buffers incoming ratings and batches them into as few retrains as possible.
+
+    A retrain is started `interval` seconds after the first buffered rating, or straight away once
+    `batch_size` ratings are waiting, whichever comes first. The buffer is emptied when a fit picks
+    up its data, so `pending` always holds the ratings the newest model has not been trained on.
+    """
+
+    def __init__(self, worker: TrainingWorker, *, interval: float = 60.0, batch_size: int = 50) -> None:
+        self.worker = worker
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pending: List[Any] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        worker.on_started = self._batch_started
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        The number of ratings that are not part of any trained or training model yet.
+        """
+        return len(self.pending)
+
+    @property
+    def last_trained_at(self) -> Optional[float]:
+        return self.worker.last_trained_at
+
+    def add(self, rating: Any) -> None:
+        """
+        Buffer a new rating and schedule a retrain for it.
+
+        :param rating: The rating that was just stored.
+        """
+        self.pending.append(rating)
+        if len(self.pending) >= self.batch_size:
+            self.trigger()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.interval, self.trigger)
+
+    def trigger(self) -> asyncio.Task:
+        """
+        Retrain now with everything that has been buffered so far.
+
+        :return: The task that will deliver the new model.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return self.worker.request()
+
+    def _batch_started(self) -> None:
+        self.pending = []
+
+    def cancel(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .engines import Engine, get_engine
+
+CURRENT_FILE = "current.json"
+
+
+def ratings_fingerprint(*columns: np.ndarray) -> str:
+    """
+    Hash the rating columns, a snapshot is only reused for the exact ratings it was trained on.
+
+    :param columns: The columns to hash, in a fixed order.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for column in columns:
+        digest.update(np.ascontiguousarray(column).data)
+    return digest.hexdigest()
+
+
+def save_snapshot(model: Engine, directory: str, fingerprint: str) -> str:
+    """
+    Write the model as one `.npy` file per array plus a small JSON header.
+
+    Every snapshot goes to a new folder of its own and `current.json` is switched over atomically,
+    so a crash halfway through never leaves a broken snapshot behind, and the files of the model
+    being served, which are memory-mapped, are never written to.
+
+    :param model: The model to save.
+    :param directory: The folder holding all snapshots.
+    :param fingerprint: The fingerprint of the data the model was trained on.
+    :return: The folder of the new snapshot.
+    """
+    name = f"snapshot-{fingerprint[:16]}-{uuid.uuid4().hex[:16]}"
+    path = os.path.join(directory, name)
+    os.makedirs(directory, exist_ok=True)
+    os.mkdir(path)
+    for key, array in model.to_arrays().items():
+        np.save(os.path.join(path, f"{key}.npy"), array, allow_pickle=False)
+
+    header = {"path": name, "fingerprint": fingerprint, "engine": model.name, **model.params()}
+    tmp_file = os.path.join(directory, f"{CURRENT_FILE}.tmp")
+    with open(tmp_file, "w") as file:
+        json.dump(header, file)
+    os.replace(tmp_file, os.path.join(directory, CURRENT_FILE))
+
+    for entry in os.listdir(directory):
+        if entry.startswith("snapshot-") and entry != name:
+            shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+    return path
+
+
+def load_snapshot(directory: str) -> Optional[Tuple[Engine, str]]:
+    """
+    Load the current snapshot, the arrays are memory-mapped copy-on-write so startup stays cheap
+    and incremental updates never touch the files.
+
+    :param directory: The folder holding all snapshots.
+    :return: The model and the fingerprint of its training data, or `None` if there is no usable
+        snapshot, e.g. none was saved yet or its files are damaged, then the model is retrained.
+    """
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as file:
+            header = json.load(file)
+        path = os.path.join(directory, header.pop("path"))
+        fingerprint = header.pop("fingerprint")
+        # Snapshots from before engines were pluggable are all SVD models
+        engine = get_engine(header.pop("engine", "svd"))
+        arrays = {
+            entry[:-4]: np.load(os.path.join(path, entry), mmap_mode="c", allow_pickle=False)
+            for entry in os.listdir(path)
+            if entry.endswith(".npy")
+        }
+        return engine.from_arrays(arrays, **header), fingerprint
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
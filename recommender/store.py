@@ -0,0 +1,374 @@
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+CURRENT_FILE = "current.json"
+
+
+class RatingStore:
+    """
+    All ratings kept in memory as three parallel columns: int32 user ids, int32 item ids and
+    float32 ratings, 12 bytes per rating.
+
+    The columns grow by doubling so appends are amortized O(1). Rows are only ever written past
+    the current size, which means the arrays returned by `columns` stay valid and unchanged while
+    the training worker reads them, even if more ratings are appended meanwhile.
+    """
+
+    def __init__(self, capacity: int = 1024) -> None:
+        self._users = np.empty(capacity, dtype=np.int32)
+        self._items = np.empty(capacity, dtype=np.int32)
+        self._ratings = np.empty(capacity, dtype=np.float32)
+        self.size = 0
+
+    # Where the columns live, for `describe`
+    location = "in memory"
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[int, int, float]]) -> "RatingStore":
+        """
+        Build a store from `(user_id, movie_id, rating)` rows.
+        """
+        rows = list(rows)
+        store = cls(max(len(rows), 1024))
+        store.extend_rows(rows)
+        return store
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def nbytes(self) -> int:
+        return self._users.nbytes + self._items.nbytes + self._ratings.nbytes
+
+    def _reserve(self, capacity: int) -> None:
+        if capacity <= len(self._users):
+            return
+        capacity = max(capacity, 2 * len(self._users))
+        for name in ("_users", "_items", "_ratings"):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[: self.size] = old[: self.size]
+            setattr(self, name, new)
+
+    def append(self, user_id: int, item_id: int, rating: float) -> None:
+        self._reserve(self.size + 1)
+        self._users[self.size] = user_id
+        self._items[self.size] = item_id
+        self._ratings[self.size] = rating
+        self.size += 1
+
+    def extend(self, users: Iterable[int], items: Iterable[int], ratings: Iterable[float]) -> None:
+        users = np.asarray(users, dtype=np.int32)
+        items = np.asarray(items, dtype=np.int32)
+        ratings = np.asarray(ratings, dtype=np.float32)
+        end = self.size + len(users)
+        self._reserve(end)
+        self._users[self.size : end] = users
+        self._items[self.size : end] = items
+        self._ratings[self.size : end] = ratings
+        self.size = end
+
+    def extend_rows(self, rows: Iterable[Tuple[int, int, float]]) -> None:
+        """
+        Append `(user_id, movie_id, rating)` rows, e.g. one chunk fetched from the database.
+        """
+        values = np.array(rows, dtype=np.float64).reshape(-1, 3)
+        self.extend(values[:, 0], values[:, 1], values[:, 2])
+
+    def describe(self) -> str:
+        """
+        A one line summary of the size of the store and the memory it takes.
+        """
+        users, items, _ = self.columns()
+        return (
+            f"{self.size:,} ratings from {len(np.unique(users)):,} users on {len(np.unique(items)):,} movies, "
+            f"{self.nbytes / 2**20:.1f} MiB {self.location}"
+        )
+
+    def columns(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The user, item and rating columns, without copying.
+        """
+        return self._users[: self.size], self._items[: self.size], self._ratings[: self.size]
+
+
+class MappedRatingStore(RatingStore):
+    """
+    Ratings persisted as fixed-width binary columns that are memory-mapped instead of loaded: int32
+    user ids, int32 item ids, float32 ratings and int64 timestamps, 20 bytes per rating on disk and
+    only the pages actually touched in memory.
+
+    The columns live in a segment folder next to `current.json`, which names the segment and holds
+    the number of rows. The first `indexed` rows of a segment are sorted by user and come with CSR
+    offsets by user (`user_indptr`) and by item (`item_indptr` into `item_order`), both indexed by
+    raw id. Rows appended afterwards go to the unindexed tail until `reindex` writes a new segment,
+    looking a user or an item up scans that tail, so it is reindexed once `needs_reindex`.
+
+    Like `RatingStore`, rows are only ever written past the current size, so the columns handed to
+    the training worker stay valid while ratings are appended. The size in `current.json` is only
+    saved by `flush`, rows appended after it are lost in a crash and have to be appended again
+    from wherever they came from. `last_rowid`, saved along with the size, is where the appended
+    rows got up to in that source, e.g. the rowid of the last rating appended from the database.
+    """
+
+    COLUMNS = {"user_id": np.int32, "movie_id": np.int32, "rating": np.float32, "timestamp": np.int64}
+    INDEXES = {"user_indptr": np.int64, "item_indptr": np.int64, "item_order": np.int64}
+    ROW_BYTES = sum(np.dtype(dtype).itemsize for dtype in COLUMNS.values())
+    # How long the unindexed tail may grow before it is worth sorting into the indexed part
+    REINDEX_TAIL = 1 << 16
+    location = "mapped from disk"
+
+    def __init__(self, directory: str, header: Dict[str, object]) -> None:
+        self.directory = directory
+        self.segment = str(header["segment"])
+        self.size = int(header["size"])
+        self.indexed = int(header["indexed"])
+        # Unknown for a store saved before the header kept it
+        self.last_rowid: Optional[int] = header.get("last_rowid")
+        self._map_segment()
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return os.path.exists(os.path.join(directory, CURRENT_FILE))
+
+    @classmethod
+    def create(cls, directory: str, capacity: int = 1 << 16) -> "MappedRatingStore":
+        """
+        Start an empty store, replacing whatever store was in the folder before.
+
+        :param directory: The folder of the store.
+        :param capacity: How many rows to make room for up front.
+        """
+        os.makedirs(directory, exist_ok=True)
+        header = {"segment": cls._write_segment(directory, {}, capacity), "size": 0, "indexed": 0, "last_rowid": 0}
+        cls._switch(directory, header)
+        return cls(directory, header)
+
+    @classmethod
+    def open(cls, directory: str) -> "MappedRatingStore":
+        """
+        Map an existing store, nothing is read until it is used.
+
+        :param directory: The folder of the store.
+        """
+        with open(os.path.join(directory, CURRENT_FILE)) as file:
+            return cls(directory, json.load(file))
+
+    @classmethod
+    def build(
+        cls, directory: str, chunks: Iterable[Tuple[np.ndarray, ...]], capacity: int = 1 << 16
+    ) -> "MappedRatingStore":
+        """
+        Write a complete store from column chunks, e.g. `MovieLensDataset.iter_ratings`, and index it.
+
+        :param directory: The folder of the store.
+        :param chunks: `(users, items, ratings, timestamps)` column tuples.
+        :param capacity: How many rows to make room for up front.
+        """
+        store = cls.create(directory, capacity)
+        for chunk in chunks:
+            store.extend(*chunk)
+        store.reindex()
+        return store
+
+    @classmethod
+    def _write_segment(cls, directory: str, arrays: Dict[str, np.ndarray], capacity: int) -> str:
+        name = f"segment-{uuid.uuid4().hex[:16]}"
+        path = os.path.join(directory, name)
+        os.makedirs(path)
+        for key, dtype in cls.COLUMNS.items():
+            with open(os.path.join(path, f"{key}.bin"), "wb") as file:
+                if key in arrays:
+                    np.ascontiguousarray(arrays[key], dtype=dtype).tofile(file)
+                file.truncate(max(capacity, 1) * np.dtype(dtype).itemsize)
+        for key, dtype in cls.INDEXES.items():
+            array = arrays.get(key, np.zeros(1 if key.endswith("indptr") else 0, dtype=dtype))
+            np.ascontiguousarray(array, dtype=dtype).tofile(os.path.join(path, f"{key}.bin"))
+        return name
+
+    @classmethod
+    def _switch(cls, directory: str, header: Dict[str, object]) -> None:
+        # Point `current.json` at the new segment first, then drop the old ones, mappings that are
+        # still open keep working on Linux as the files only go away once they are unmapped
+        cls._write_header(directory, header)
+        for entry in os.listdir(directory):
+            if entry.startswith("segment-") and entry != header["segment"]:
+                shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+    @staticmethod
+    def _write_header(directory: str, header: Dict[str, object]) -> None:
+        tmp_file = os.path.join(directory, f"{CURRENT_FILE}.tmp")
+        with open(tmp_file, "w") as file:
+            json.dump(header, file)
+        os.replace(tmp_file, os.path.join(directory, CURRENT_FILE))
+
+    def _map(self, key: str, dtype: type, mode: str) -> np.ndarray:
+        path = os.path.join(self.directory, self.segment, f"{key}.bin")
+        if os.path.getsize(path) == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode=mode)
+
+    def _map_segment(self) -> None:
+        self._users = self._map("user_id", np.int32, "r+")
+        self._items = self._map("movie_id", np.int32, "r+")
+        self._ratings = self._map("rating", np.float32, "r+")
+        self._timestamps = self._map("timestamp", np.int64, "r+")
+        self._user_indptr = self._map("user_indptr", np.int64, "r")
+        self._item_indptr = self._map("item_indptr", np.int64, "r")
+        self._item_order = self._map("item_order", np.int64, "r")
+
+    @property
+    def nbytes(self) -> int:
+        # The stored rows, not the capacity mapped for the next appends which takes no memory until it is written
+        return self.size * self.ROW_BYTES
+
+    @property
+    def needs_reindex(self) -> bool:
+        return self.size - self.indexed >= self.REINDEX_TAIL
+
+    def _reserve(self, capacity: int) -> None:
+        if capacity <= len(self._users):
+            return
+        capacity = max(capacity, 2 * len(self._users))
+        self.flush()
+        for key, dtype in self.COLUMNS.items():
+            os.truncate(
+                os.path.join(self.directory, self.segment, f"{key}.bin"), capacity * np.dtype(dtype).itemsize
+            )
+        # Arrays handed out before keep the old, smaller mapping, which stays valid
+        self._map_segment()
+
+    def _header(self) -> Dict[str, object]:
+        return {"segment": self.segment, "size": self.size, "indexed": self.indexed, "last_rowid": self.last_rowid}
+
+    def append(self, user_id: int, item_id: int, rating: float, timestamp: Optional[int] = None) -> None:
+        self.extend([user_id], [item_id], [rating], [int(time.time()) if timestamp is None else timestamp])
+
+    def extend(
+        self,
+        users: Iterable[int],
+        items: Iterable[int],
+        ratings: Iterable[float],
+        timestamps: Optional[Iterable[int]] = None,
+    ) -> None:
+        users = np.asarray(users, dtype=np.int32)
+        end = self.size + len(users)
+        self._reserve(end)
+        self._users[self.size : end] = users
+        self._items[self.size : end] = np.asarray(items, dtype=np.int32)
+        self._ratings[self.size : end] = np.asarray(ratings, dtype=np.float32)
+        self._timestamps[self.size : end] = int(time.time()) if timestamps is None else np.asarray(timestamps)
+        self.size = end
+
+    def extend_rows(self, rows: Iterable[Tuple[int, int, float, int]]) -> None:
+        """
+        Append `(user_id, movie_id, rating, timestamp)` rows, e.g. one chunk fetched from the database.
+        """
+        values = np.array(rows, dtype=np.float64).reshape(-1, 4)
+        self.extend(values[:, 0], values[:, 1], values[:, 2], values[:, 3].astype(np.int64))
+
+    def timestamps(self) -> np.ndarray:
+        return self._timestamps[: self.size]
+
+    def _tail_rows(self, column: np.ndarray, key: int) -> np.ndarray:
+        return self.indexed + np.flatnonzero(column[self.indexed : self.size] == key)
+
+    def user_ratings(self, user_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Every rating of a user. Ratings from the indexed part are a zero-copy slice of the map.
+
+        :param user_id: The raw id of the user.
+        :return: The raw item ids and the ratings.
+        """
+        start = end = 0
+        if 0 <= user_id < len(self._user_indptr) - 1:
+            start, end = self._user_indptr[user_id], self._user_indptr[user_id + 1]
+        tail = self._tail_rows(self._users, user_id)
+        if not len(tail):
+            return self._items[start:end], self._ratings[start:end]
+        return (
+            np.concatenate([self._items[start:end], self._items[tail]]),
+            np.concatenate([self._ratings[start:end], self._ratings[tail]]),
+        )
+
+    def item_ratings(self, item_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Every rating of an item.
+
+        :param item_id: The raw id of the item.
+        :return: The raw user ids and the ratings.
+        """
+        rows = self._item_order[:0]
+        if 0 <= item_id < len(self._item_indptr) - 1:
+            rows = self._item_order[self._item_indptr[item_id] : self._item_indptr[item_id + 1]]
+        rows = np.concatenate([rows, self._tail_rows(self._items, item_id)])
+        return self._users[rows], self._ratings[rows]
+
+    def reindex(self) -> None:
+        """
+        Sort every row by user into a new segment and rebuild both CSR indexes, which empties the tail.
+        """
+        self.use_index(*self.write_index())
+
+    def write_index(self) -> Tuple[str, int]:
+        """
+        The slow half of `reindex`: sort the current rows into a new segment and index them.
+
+        It only reads rows that are already stored, so it can run on another thread while ratings
+        are appended. `use_index` then switches to the new segment, on the thread that appends.
+
+        :return: The name of the new segment and how many rows it holds.
+        """
+        size = self.size
+        users, items, ratings, timestamps = (column[:size] for column in (*self.columns(), self.timestamps()))
+        order = np.lexsort((items, users))
+        users, items = users[order], items[order]
+        n_users = int(users.max(initial=-1)) + 1
+        n_items = int(items.max(initial=-1)) + 1
+        user_indptr = np.zeros(n_users + 1, dtype=np.int64)
+        np.cumsum(np.bincount(users, minlength=n_users), out=user_indptr[1:])
+        item_indptr = np.zeros(n_items + 1, dtype=np.int64)
+        np.cumsum(np.bincount(items, minlength=n_items), out=item_indptr[1:])
+        arrays = {
+            "user_id": users,
+            "movie_id": items,
+            "rating": ratings[order],
+            "timestamp": timestamps[order],
+            "user_indptr": user_indptr,
+            "item_indptr": item_indptr,
+            "item_order": np.argsort(items, kind="stable"),
+        }
+        return self._write_segment(self.directory, arrays, max(size, 1 << 16)), size
+
+    def use_index(self, segment: str, indexed: int) -> None:
+        """
+        Switch to a segment written by `write_index`, the rows appended since are carried over to its tail.
+
+        :param segment: The name of the new segment.
+        :param indexed: How many rows it holds.
+        """
+        late = [column[indexed : self.size].copy() for column in (*self.columns(), self.timestamps())]
+        self.segment, self.size, self.indexed = segment, indexed, indexed
+        self._map_segment()
+        self.extend(*late)
+        self._flush_columns()
+        self._switch(self.directory, self._header())
+
+    def _flush_columns(self) -> None:
+        for name in ("_users", "_items", "_ratings", "_timestamps"):
+            column = getattr(self, name)
+            if isinstance(column, np.memmap):
+                column.flush()
+
+    def flush(self) -> None:
+        """
+        Write the appended rows to disk, then save the size that counts them.
+        """
+        self._flush_columns()
+        self._write_header(self.directory, self._header())
@@ -0,0 +1,97 @@
+import functools
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from fuzzywuzzy import fuzz, utils
+
+YEAR = re.compile(r"\s*\(\d{4}\)\s*$")
+# MovieLens moves leading articles to the end: "Usual Suspects, The (1995)"
+TRAILING_ARTICLE = re.compile(r"^(.*), (the|a|an|les|la|le|il|el|das|der|die)$", re.IGNORECASE)
+
+
+def normalize_title(title: str) -> str:
+    """
+    Normalize a title for matching: drop the release year, put a trailing article back in front,
+    then lowercase and strip punctuation the same way fuzzywuzzy does and collapse whitespace.
+    """
+    title = YEAR.sub("", title.strip())
+    title = TRAILING_ARTICLE.sub(r"\2 \1", title)
+    return " ".join(utils.full_process(title).split())
+
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    """
+    Fuzzy title search that only runs the expensive scorer on a handful of candidates.
+
+    Titles are normalized once and indexed by character trigram. A query first ranks every title
+    by the number of trigrams it shares with the query, using the inverted index, and only the best
+    `candidates` titles are scored with fuzzywuzzy's `WRatio`. Results are cached per query.
+    """
+
+    def __init__(
+        self,
+        movies: Iterable[Tuple[int, str]],
+        *,
+        score_cutoff: int = 70,
+        candidates: int = 50,
+        cache_size: int = 4096,
+    ) -> None:
+        self.score_cutoff = score_cutoff
+        self.candidates = candidates
+        self.movie_ids: List[int] = []
+        self.titles: List[str] = []
+        self.normalized: List[str] = []
+
+        postings: Dict[str, List[int]] = defaultdict(list)
+        for movie_id, title in movies:
+            position = len(self.titles)
+            normalized = normalize_title(title)
+            self.movie_ids.append(movie_id)
+            self.titles.append(title)
+            self.normalized.append(normalized)
+            for gram in trigrams(normalized):
+                postings[gram].append(position)
+        self.postings: Dict[str, np.ndarray] = {
+            gram: np.array(positions, dtype=np.int32) for gram, positions in postings.items()
+        }
+
+        self.match = functools.lru_cache(maxsize=cache_size)(self._match)
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def _candidates(self, query: str) -> np.ndarray:
+        lists = [self.postings[gram] for gram in trigrams(query) if gram in self.postings]
+        if not lists:
+            return np.empty(0, dtype=np.int32)
+        counts = np.bincount(np.concatenate(lists), minlength=len(self.titles))
+        found = np.count_nonzero(counts)
+        if found <= self.candidates:
+            return np.flatnonzero(counts)
+        return np.argpartition(-counts, self.candidates - 1)[: self.candidates]
+
+    def _match(self, query: str) -> Optional[Tuple[str, int, int]]:
+        """
+        Find the title closest to the query.
+
+        :param query: A (partial) movie title.
+        :return: The title, its movie id and the match score, or `None` if nothing reaches the cutoff.
+        """
+        normalized = normalize_title(query)
+        if not normalized:
+            return None
+        best, best_score = None, self.score_cutoff - 1
+        for position in self._candidates(normalized).tolist():
+            score = fuzz.WRatio(normalized, self.normalized[position], force_ascii=True, full_process=False)
+            if score > best_score:
+                best, best_score = position, score
+        if best is None:
+            return None
+        return self.titles[best], self.movie_ids[best], best_score
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import numpy as np
+from surprise import Trainset
+
+from .engines import Engine, get_engine
+from .snapshot import ratings_fingerprint, save_snapshot
+
+logger = logging.getLogger("discord_bot.recommender")
+
+
+def build_trainset(
+    users: np.ndarray, items: np.ndarray, ratings: np.ndarray, rating_scale: Tuple[float, float] = (1, 5)
+) -> Trainset:
+    """
+    Build a Surprise trainset straight from rating columns, without going through a `Dataset`.
+
+    Raw ids are mapped to inner ids with `np.unique`, only filling the per-user and per-item
+    rating lists is left to Python.
+
+    :param users: The raw user id of every rating.
+    :param items: The raw item id of every rating.
+    :param ratings: The ratings.
+    :param rating_scale: The lowest and highest possible rating.
+    """
+    user_ids, inner_users = np.unique(users, return_inverse=True)
+    item_ids, inner_items = np.unique(items, return_inverse=True)
+    ur = defaultdict(list)
+    ir = defaultdict(list)
+    for u, i, r in zip(inner_users.tolist(), inner_items.tolist(), ratings.tolist()):
+        ur[u].append((i, r))
+        ir[i].append((u, r))
+    return Trainset(
+        ur,
+        ir,
+        len(user_ids),
+        len(item_ids),
+        len(ratings),
+        rating_scale,
+        {raw: inner for inner, raw in enumerate(user_ids.tolist())},
+        {raw: inner for inner, raw in enumerate(item_ids.tolist())},
+    )
+
+
+def fit_model(
+    users: np.ndarray,
+    items: np.ndarray,
+    ratings: np.ndarray,
+    snapshot_dir: Optional[str] = None,
+    n_neighbors: int = 20,
+    rating_scale: Tuple[float, float] = (1, 5),
+    engine: str = "svd",
+    engine_options: Optional[Dict[str, Any]] = None,
+) -> Engine:
+    """
+    Fit a brand new model on all the ratings.
+
+    This is what the training worker runs, it never touches the model that is currently being served.
+
+    :param users: The raw user id of every rating.
+    :param items: The raw item id of every rating.
+    :param ratings: The ratings.
+    :param snapshot_dir: If given, the fitted model is saved there so the next startup can skip training.
+    :param n_neighbors: How many similar items to precompute per item.
+    :param rating_scale: The lowest and highest possible rating.
+    :param engine: The name of the engine to fit, see `ENGINES`.
+    :param engine_options: Settings passed on to the engine.
+    :return: The fitted model.
+    """
+    model = get_engine(engine).fit(
+        users, items, ratings, rating_scale=rating_scale, n_neighbors=n_neighbors, **(engine_options or {})
+    )
+    if snapshot_dir:
+        save_snapshot(model, snapshot_dir, ratings_fingerprint(users, items, ratings))
+    return model
+
+
+class TrainingWorker:
+    """
+    Fits recommender models on a dedicated background thread so the event loop keeps running.
+
+    Only one fit runs at a time. Requests made while a fit is in progress are coalesced into a
+    single follow-up fit. `on_started` is called from the event loop right before a fit picks up
+    its data, and every finished model is handed to `on_trained` from the event loop.
+
+    When `load_fn` is given, it is awaited on the event loop before every fit and the tuple it
+    returns is passed to `train_fn` as positional arguments.
+
+    Surprise's SGD loop iterates over a Python generator, so the interpreter keeps switching back
+    to the event loop thread during a fit. A thread also avoids pickling the trainset and
+    re-importing `bot.py` in a child process.
+    """
+
+    def __init__(
+        self,
+        train_fn: Callable[[], Any],
+        on_trained: Callable[[Any], None],
+        on_started: Optional[Callable[[], None]] = None,
+        load_fn: Optional[Callable[[], Awaitable[tuple]]] = None,
+    ) -> None:
+        self.train_fn = train_fn
+        self.on_trained = on_trained
+        self.on_started = on_started
+        self.load_fn = load_fn
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recommender-training")
+        self._task: Optional[asyncio.Task] = None
+        self._pending = False
+        self.last_trained_at: Optional[float] = None
+        self.last_duration: Optional[float] = None
+
+    @property
+    def is_training(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def request(self) -> asyncio.Task:
+        """
+        Ask for a fresh model to be trained.
+
+        :return: The task that will deliver the requested model.
+        """
+        if self.is_training:
+            self._pending = True
+        else:
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def wait(self) -> None:
+        """
+        Wait until the worker is idle.
+        """
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._pending = False
+            if self.on_started is not None:
+                self.on_started()
+            started = time.monotonic()
+            try:
+                args = await self.load_fn() if self.load_fn is not None else ()
+                model = await loop.run_in_executor(self._executor, self.train_fn, *args)
+            except Exception:
+                logger.exception("Training the recommender model failed")
+            else:
+                self.last_trained_at = time.time()
+                self.last_duration = time.monotonic() - started
+                self.on_trained(model)
+            if not self._pending:
+                return
+
+    def shutdown(self) -> None:
+        """
+        Stop the worker, a fit that is already running is abandoned.
+        """
+        if self._task is not None:
+            self._task.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,87 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+
+class UserRegistry:
+    """
+    The Discord users registered with the recommender, indexed both ways.
+
+    Users are identified by their Discord user ID, which never changes. Usernames are only a
+    secondary index, kept up to date by `resolve` when someone renames themselves. Recommender user
+    ids map back to both. New ids are handed out from a counter, so registering a user never has to
+    look at the existing ones.
+    """
+
+    def __init__(self, next_id: int = 1) -> None:
+        self.by_discord_id: Dict[str, int] = {}
+        self.by_username: Dict[str, int] = {}
+        self.discord_ids: Dict[int, str] = {}
+        self.usernames: Dict[int, str] = {}
+        self.next_id = next_id
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[int, str, str]], max_user_id: int = 0) -> "UserRegistry":
+        """
+        Build the registry from `(user_id, discord_user_id, discord_username)` rows in one pass per
+        index, the dictionaries are filled by `dict(zip(...))` rather than row by row.
+
+        :param rows: The registered users, as returned by `DatabaseManager.get_recommender_users`.
+        :param max_user_id: The highest user id in use, including users without a Discord account.
+        """
+        registry = cls()
+        columns = list(zip(*rows))
+        if columns:
+            user_ids, discord_ids, usernames = columns
+            registry.by_discord_id = dict(zip(discord_ids, user_ids))
+            registry.by_username = dict(zip(usernames, user_ids))
+            registry.discord_ids = dict(zip(user_ids, discord_ids))
+            registry.usernames = dict(zip(user_ids, usernames))
+            max_user_id = max(max_user_id, max(user_ids))
+        registry.next_id = max_user_id + 1
+        return registry
+
+    def __len__(self) -> int:
+        return len(self.discord_ids)
+
+    def allocate_id(self) -> int:
+        """
+        Reserve the id for a new user.
+        """
+        user_id = self.next_id
+        self.next_id += 1
+        return user_id
+
+    def add(self, user_id: int, discord_user_id: str, discord_username: str) -> None:
+        self.by_discord_id[discord_user_id] = user_id
+        self.discord_ids[user_id] = discord_user_id
+        self._set_username(user_id, discord_username)
+
+    def _set_username(self, user_id: int, discord_username: str) -> None:
+        old_username = self.usernames.get(user_id)
+        if old_username is not None and self.by_username.get(old_username) == user_id:
+            del self.by_username[old_username]
+        self.by_username[discord_username] = user_id
+        self.usernames[user_id] = discord_username
+
+    def resolve(self, discord_user_id: str, discord_username: str) -> Tuple[Optional[int], bool]:
+        """
+        Find the recommender user behind a Discord user, by Discord user ID.
+
+        If the user renamed themselves since they registered, the username index is updated.
+
+        :param discord_user_id: The ID of the Discord user.
+        :param discord_username: The current name of the Discord user.
+        :return: The recommender user id, or `None` if the user isn't registered, and whether the username changed.
+        """
+        user_id = self.by_discord_id.get(discord_user_id)
+        if user_id is None:
+            return None, False
+        if self.usernames.get(user_id) == discord_username:
+            return user_id, False
+        self._set_username(user_id, discord_username)
+        return user_id, True
+
+    def get_by_username(self, discord_username: str) -> Optional[int]:
+        return self.by_username.get(discord_username)
+
+    def get_by_discord_id(self, discord_user_id: str) -> Optional[int]:
+        return self.by_discord_id.get(discord_user_id)